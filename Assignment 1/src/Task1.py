@@ -1,5 +1,7 @@
 import pandas as pd
 
+from grid_file import assign_cells, build_grid_file, epoch_seconds
+
 # reset the Pandas
 pd.set_option('display.max_columns', None)  # All lines
 pd.set_option('display.expand_frame_repr', False)  # not \n
@@ -17,11 +19,13 @@ max_lon = df['Start_Lon'].max()
 min_lat = df['Start_Lat'].min()
 max_lat = df['Start_Lat'].max()
 
-# datetime
+# datetime, converted once to int64 epoch seconds for the whole column (rows without a pickup time are dropped)
 df['Trip_Pickup_DateTime'] = pd.to_datetime(df['Trip_Pickup_DateTime'])
+df = df.dropna(subset=['Trip_Pickup_DateTime'])
+timestamps = epoch_seconds(df['Trip_Pickup_DateTime'])
 
-min_time = df['Trip_Pickup_DateTime'].min().timestamp()
-max_time = df['Trip_Pickup_DateTime'].max().timestamp()
+min_time = timestamps.min()
+max_time = timestamps.max()
 
 # # print and save
 # df.info()
@@ -34,26 +38,31 @@ print(min_lon, max_lon, min_lat, max_lat, min_time, max_time, "\n\n\n\n")
 
 
 # Step 1.2
-# grid with 100x100x100
+# grid with 100x100x100 cells by default, cells along lon, lat and time can be set separately
+grid_shape = (100, 100, 100)
 
-grid_size = 100
+# 'uniform': equal-width buckets between min and max,
+# 'quantile': equi-depth buckets, balanced cell sizes on skewed data (boundaries go to the grid header)
+partitioning = 'uniform'
 
+# order of the cells in grid.bin: 'linear' (sorted x, y, t) or 'morton' (Z-order curve, a box query
+# reads a few contiguous runs of the memory-mapped file instead of many scattered cells)
+layout = 'linear'
 
-# # step int(100 * ((x-min_x) / (max_x-min_x+0.000001))
-# lon_step = (max_lon - min_lon) / grid_size
-# lat_step = (max_lat - min_lat) / grid_size
-# time_step = (max_time - min_time) / grid_size
+# random sample of up to sample_size records kept per cell, the approximate query of Task2 checks the
+# sample of a partially inside cell instead of assuming uniform records (0: no samples)
+sample_size = 32
 
-# which grid
-def get_partition(value, min_value, max_value):
-    return int(100 * (value - min_value) / (max_value - min_value + 1e-6))  # protect from overflow
+# per-cell histograms with histogram_bins bins along lon, lat and time, used by the approximate query
+# when there are no samples, a few bytes per cell instead of reading records (0: no histograms)
+histogram_bins = 0
 
+# allocate, whole columns at once
+bounds = (min_lon, max_lon, min_lat, max_lat, min_time, max_time)
 
-# allocate
-df['lon_partition'] = df['Start_Lon'].apply(lambda lon: get_partition(lon, min_lon, max_lon))
-df['lat_partition'] = df['Start_Lat'].apply(lambda lat: get_partition(lat, min_lat, max_lat))
-df['time_partition'] = df['Trip_Pickup_DateTime'].apply(
-    lambda time: get_partition(time.timestamp(), min_time, max_time))
+partitions, edges, grid_shape = assign_cells(df['Start_Lon'].to_numpy(), df['Start_Lat'].to_numpy(), timestamps,
+                                             bounds, grid_shape, partitioning)
+df['lon_partition'], df['lat_partition'], df['time_partition'] = partitions
 
 df.info()
 print(df.head(20), "\n\n\n\n")
@@ -61,43 +70,7 @@ print(df.head(20), "\n\n\n\n")
 df.to_parquet('../Datasets/data_select.parquet', index=False)
 
 # Step 1.3
-# dictionary store the grids info
-grid = {}
-
-# Traverse every line
-for _, row in df.iterrows():
-    # Grid coordinates
-    cell_key = (row['lon_partition'], row['lat_partition'], row['time_partition'])
-
-    # creat new list if not exist
-    if cell_key not in grid:
-        grid[cell_key] = []
-
-    # insert
-    grid[cell_key].append(
-        (row['Start_Lon'], row['Start_Lat'], row['Trip_Pickup_DateTime'].timestamp(), row['Total_Amt']))
-
-# output file to grid.txt
-with open('../Datasets/grid.txt', 'w') as f:
-    # write min and max
-    f.write(f"{min_lon}, {max_lon}\n")
-    f.write(f"{min_lat}, {max_lat}\n")
-    f.write(f"{min_time}, {max_time}\n")
-
-    # sort
-    sorted_cells = sorted(grid.keys())
-
-    # Traverse
-    for cell_key in sorted_cells:
-        cell_x, cell_y, cell_t = cell_key
-
-        # Total_Amount
-        num_records_in_cell = len(grid[cell_key])
-
-        # write in
-        f.write(f"({cell_x},{cell_y},{cell_t})\n")
-        f.write(f"{num_records_in_cell}\n")
-
-        # write details
-        for record in grid[cell_key]:
-            f.write(f"{record[0]},{record[1]},{record[2]},{record[3]}\n")
+# output file to grid.bin, with the cumulative count cube and the per-cell samples
+build_grid_file('../Datasets/grid.bin', df['Start_Lon'].to_numpy(), df['Start_Lat'].to_numpy(), timestamps,
+                df['Total_Amt'].to_numpy(), bounds, partitions, grid_shape, edges, prefix_cube=True, layout=layout,
+                sample_size=sample_size, histogram_bins=histogram_bins)
@@ -1,7 +1,14 @@
+import numpy as np
 import pandas as pd
-from datetime import datetime
-from rtree import index
+import os
 import time
+from multiprocessing import Pool
+
+from grid_file import (amount_aggregate, approximate_box_count, bounded_box_count, get_cell_ranges,
+                       get_cell_ranges_batch, get_cell_status_and_fraction, grid_part_files, histogram_box_count,
+                       inside_count, inside_count_batch, load_grid_file, load_grid_parts, match_records, parse_time,
+                       record_indices, sampled_box_count, shell_cell_ids, shell_match_count)
+from query_cache import QueryCache
 
 # 设置 pandas 显示选项，确保显示所有列
 pd.set_option('display.max_columns', None)  # 显示所有列
@@ -10,46 +17,10 @@ pd.set_option('display.max_rows', 50)  # 如果你想显示更多行，可以修
 
 
 def load_grid_from_file(filename):
-    grid = {}  # dictionary
-    min_lon, max_lon = None, None
-    min_lat, max_lat = None, None
-    min_time, max_time = None, None
-
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-
-        # get the global min and max
-        min_lon, max_lon = map(float, lines[0].strip().split(','))
-        min_lat, max_lat = map(float, lines[1].strip().split(','))
-        min_time, max_time = map(float, lines[2].strip().split(','))
-
-        # Parse the remaining grid data line by line
-        i = 3
-        while i < len(lines):
-            # Read the coordinates (x, y, t) of the grid cells
-            cell_coords = lines[i].strip()
-            cell_x, cell_y, cell_t = map(int, cell_coords.strip('()').split(','))
-            cell_key = (cell_x, cell_y, cell_t)
-
-            # Read the total amount of the cell
-            total_amt_in_cell = int(lines[i + 1].strip())
-
-            # Initialize the record list for THIS grid cell
-            grid[cell_key] = {
-                'count': total_amt_in_cell,  # total amount
-                'records': []
-            }
-
-            # 从 i + 2 开始读取所有属于该网格单元的记录
-            i += 2
-            while i < len(lines) and not lines[i].startswith('('):
-                # 每一行是 x, y, timestamp, Total_Amt
-                x, y, timestamp, total_amt = map(float, lines[i].strip().split(','))
-                grid[cell_key]['records'].append((x, y, timestamp, total_amt))
-                i += 1  # 继续读取下一行
-
-            # 注意此时 i 指向下一个网格单元的坐标行，继续循环处理
-        return grid, (min_lon, max_lon, min_lat, max_lat, min_time, max_time)
+    # the sections are memory-mapped, records are only read when a query touches them
+    grid = load_grid_file(filename)
+    min_lon, max_lon, min_lat, max_lat, min_time, max_time = grid['bounds']
+    return grid, (min_lon, max_lon, min_lat, max_lat, min_time, max_time)
 
 
 # exact query
@@ -65,30 +36,24 @@ def exact_query_processing(grid, query_file, min_lon, max_lon, min_lat, max_lat,
         query_parts = query.strip().split(',')
         low_x, up_x = float(query_parts[0]), float(query_parts[1])
         low_y, up_y = float(query_parts[2]), float(query_parts[3])
-        low_time = datetime.strptime(query_parts[4], "%Y-%m-%d %H:%M:%S").timestamp()
-        up_time = datetime.strptime(query_parts[5], "%Y-%m-%d %H:%M:%S").timestamp()
+        low_time = parse_time(query_parts[4])
+        up_time = parse_time(query_parts[5])
 
         # total amount = 0
         total_amount = 0
 
-        # Traverse grid cells
-        for cell_key, cell_data in grid.items():
-            lon_partition, lat_partition, time_partition = cell_key
-
-            # Check if the grid cells intersect with the geographic and temporal range of the query
-            cell_status = get_cell_status(cell_key, low_x, up_x, low_y, up_y, low_time, up_time,
-                                          min_lon, max_lon, min_lat, max_lat, min_time, max_time)
-
-            if cell_status == "fully_inside":
-                # If the grid cells are completely included in the query range, use Total_Smt_in_cell directly
-                total_amount += cell_data['count']
-            elif cell_status == "partially_inside":
-                # If it is partially included, it is necessary to check the records item by item
-                for record in cell_data['records']:
-                    lon, lat, timestamp, amount = record
-                    # Check if each record meets the query criteria
-                    if low_x <= lon <= up_x and low_y <= lat <= up_y and low_time <= timestamp <= up_time:
-                        total_amount += 1
+        # Only the cells overlapping the query box are visited
+        ranges = get_cell_ranges(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+
+        if all(first <= last for first, last, _, _ in ranges):
+            # If the grid cells are completely included in the query range, use Total_Smt_in_cell directly,
+            # they form one box of cells counted from the prefix cube
+            total_amount += inside_count(grid, ranges)
+
+            # If it is partially included, it is necessary to check the records of the cell
+            match = match_records(grid, record_indices(grid, shell_cell_ids(grid, ranges)),
+                                  low_x, up_x, low_y, up_y, low_time, up_time)
+            total_amount += int(np.count_nonzero(match))
 
         # Save the results of each query
         exact_results.append(total_amount)
@@ -96,37 +61,116 @@ def exact_query_processing(grid, query_file, min_lon, max_lon, min_lat, max_lat,
     return exact_results
 
 
-def get_cell_status(cell_key, low_x, up_x, low_y, up_y, low_time, up_time,
-                    min_lon, max_lon, min_lat, max_lat, min_time, max_time):
-    lon_partition, lat_partition, time_partition = cell_key
+# exact query through the result cache of query_cache.py, repeated boxes and boundary cells
+# already counted by an overlapping box are not scanned again
+def cached_query_processing(cache, query_file):
+    return [cache.count(low_x, up_x, low_y, up_y, low_time, up_time)
+            for low_x, up_x, low_y, up_y, low_time, up_time in load_query_boxes(query_file).tolist()]
+
+
+def load_query_boxes(query_file):
+    # all queries as one (Q, 6) array: low_x, up_x, low_y, up_y, low_time, up_time
+    boxes = []
+    with open(query_file, 'r') as f:
+        for query in f:
+            if not query.strip():
+                continue
+            query_parts = query.strip().split(',')
+            boxes.append((float(query_parts[0]), float(query_parts[1]),
+                          float(query_parts[2]), float(query_parts[3]),
+                          parse_time(query_parts[4]),
+                          parse_time(query_parts[5])))
+    return np.array(boxes, dtype=np.float64).reshape(-1, 6)
 
-    # Calculate the longitude, latitude, and time range of the unit based on the number of partitions
-    cell_min_lon = min_lon + (lon_partition / 100) * (max_lon - min_lon)
-    cell_max_lon = min_lon + ((lon_partition + 1) / 100) * (max_lon - min_lon)
 
-    cell_min_lat = min_lat + (lat_partition / 100) * (max_lat - min_lat)
-    cell_max_lat = min_lat + ((lat_partition + 1) / 100) * (max_lat - min_lat)
+# exact query, all queries in one pass
+def exact_query_processing_batch(grid, query_file):
+    boxes = load_query_boxes(query_file)
+    return exact_counts_batch(grid, boxes).tolist()
 
-    cell_min_time = min_time + (time_partition / 100) * (max_time - min_time)
-    cell_max_time = min_time + ((time_partition + 1) / 100) * (max_time - min_time)
 
-    # fully included in the query scope
-    if (low_x <= cell_min_lon and cell_max_lon <= up_x and
-            low_y <= cell_min_lat and cell_max_lat <= up_y and
-            low_time <= cell_min_time and cell_max_time <= up_time):
-        return "fully_inside"
+def exact_counts_batch(grid, boxes):
+    exact_results = np.zeros(len(boxes), dtype=np.int64)
+
+    # cell ranges of every query at once, fully inside boxes counted together
+    ranges = get_cell_ranges_batch(grid, boxes)
+    overlap = np.all(ranges[:, :, 0] <= ranges[:, :, 1], axis=1)
+    exact_results[overlap] = inside_count_batch(grid, ranges[overlap])
+
+    # records of the partially inside cells, query by query against its scalar bounds (no per-record copy
+    # of the bounds), a face cell of the box only compares the column of the axis it sticks out of
+    for q in np.flatnonzero(overlap).tolist():
+        exact_results[q] += shell_match_count(grid, ranges[q].tolist(), *boxes[q].tolist())
+
+    return exact_results
+
 
-    # partially included in the query scope
-    if (cell_max_lon >= low_x and cell_min_lon <= up_x and
-            cell_max_lat >= low_y and cell_min_lat <= up_y and
-            cell_max_time >= low_time and cell_min_time <= up_time):
-        return "partially_inside"
+# every worker process maps the grid file itself, the grid is never pickled
+worker_grid = None
 
-    # not within the query range
-    return "outside"
+
+def init_worker(grid_file):
+    global worker_grid
+    worker_grid = load_grid_file(grid_file)
+
+
+# a worker runs the same engine as the batch mode (option 2) on its chunk of queries
+def run_query_chunk(chunk):
+    start, boxes = chunk
+    start_time = time.time()
+    counts = exact_counts_batch(worker_grid, boxes)
+    return start, counts, os.getpid(), time.time() - start_time
+
+
+# exact query, chunks of queries spread over a pool of processes
+def exact_query_processing_parallel(grid_file, query_file, workers=None, chunk_size=64):
+    boxes = load_query_boxes(query_file)
+    exact_results = np.zeros(len(boxes), dtype=np.int64)
+    chunks = [(start, boxes[start:start + chunk_size]) for start in range(0, len(boxes), chunk_size)]
+    # more processes than cpus only share the same cores
+    cpus = os.cpu_count() or 1
+    workers = min(workers or cpus, cpus, len(chunks))
+
+    if workers <= 1:
+        # a single worker only adds the pool start up and a second mapping of the grid, run it in this process
+        init_worker(grid_file)
+        exact_results[:] = exact_counts_batch(worker_grid, boxes)
+        return exact_results.tolist()
+
+    worker_stats = {}  # pid -> [queries, busy seconds]
+    with Pool(workers, initializer=init_worker, initargs=(grid_file,)) as pool:
+        for start, counts, pid, elapsed in pool.imap_unordered(run_query_chunk, chunks):
+            # results go back to their input position
+            exact_results[start:start + len(counts)] = counts
+            stats = worker_stats.setdefault(pid, [0, 0.0])
+            stats[0] += len(counts)
+            stats[1] += elapsed
+
+    for pid, (num_queries, busy) in sorted(worker_stats.items()):
+        throughput = num_queries / busy if busy > 0 else float('inf')
+        print(f"worker {pid}: {num_queries} queries in {busy:.2f} s ({throughput:.1f} queries/s)")
+
+    return exact_results.tolist()
 
 
 # approximate query
+def approximate_estimate(grid, low_x, up_x, low_y, up_y, low_time, up_time):
+    # overlap ratio f of every cell in the block overlapping the query box,
+    # fully inside cells have f == 1, partially inside add f * Total_Amt_in_cell.
+    # A grid built with per-cell samples uses the share of the sample in the box instead of f,
+    # one built with per-cell histograms the share of the histogram bins in the box
+    if 'sample_offsets' in grid:
+        return sampled_box_count(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if 'hist_lon' in grid:
+        return histogram_box_count(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if 'prefix_count' in grid:
+        return approximate_box_count(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    block, f = get_cell_status_and_fraction(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if block is None:
+        return 0
+    return float((f * grid['cell_count'][block]).sum())
+
+
 def approximate_query_processing(grid, query_file, min_lon, max_lon, min_lat, max_lat, min_time, max_time):
     approximate_results = []  # Used to store the results of each query
 
@@ -139,26 +183,12 @@ def approximate_query_processing(grid, query_file, min_lon, max_lon, min_lat, ma
         query_parts = query.strip().split(',')
         low_x, up_x = float(query_parts[0]), float(query_parts[1])
         low_y, up_y = float(query_parts[2]), float(query_parts[3])
-        low_time = datetime.strptime(query_parts[4], "%Y-%m-%d %H:%M:%S").timestamp()
-        up_time = datetime.strptime(query_parts[5], "%Y-%m-%d %H:%M:%S").timestamp()
+        low_time = parse_time(query_parts[4])
+        up_time = parse_time(query_parts[5])
 
         # total amount = 0
         total_amount = 0
-
-        # traverse
-        for cell_key, cell_data in grid.items():
-            lon_partition, lat_partition, time_partition = cell_key
-
-            # check if the grid cells intersect with the geographic and temporal range of the query
-            cell_status, f = get_cell_status_and_fraction(cell_key, low_x, up_x, low_y, up_y, low_time, up_time,
-                                                          min_lon, max_lon, min_lat, max_lat, min_time, max_time)
-
-            if cell_status == "fully_inside":
-                # completely included in the query range add Total_Smt_in_cell directly
-                total_amount += cell_data['count']
-            elif cell_status == "partially_inside":
-                # partially included, add f * Total_Amt_in_cell
-                total_amount += f * cell_data['count']
+        total_amount += approximate_estimate(grid, low_x, up_x, low_y, up_y, low_time, up_time)
         total_amount = round(total_amount)
         # save
         approximate_results.append(total_amount)
@@ -166,35 +196,120 @@ def approximate_query_processing(grid, query_file, min_lon, max_lon, min_lat, ma
     return approximate_results
 
 
-def get_cell_status_and_fraction(cell_key, low_x, up_x, low_y, up_y, low_time, up_time,
-                                 min_lon, max_lon, min_lat, max_lat, min_time, max_time):
-    lon_partition, lat_partition, time_partition = cell_key
+# approximate query with an error bound: estimate and an interval that surely holds the exact count,
+# partially inside cells are scanned (largest first) until the relative error is below target_error
+def bounded_query_processing(grid, query_file, target_error=0.05):
+    bounded_results = []
 
-    # Calculate the longitude, latitude, and time range of the unit based on the number of partitions
-    cell_min_lon = min_lon + (lon_partition / 100) * (max_lon - min_lon)
-    cell_max_lon = min_lon + ((lon_partition + 1) / 100) * (max_lon - min_lon)
+    for low_x, up_x, low_y, up_y, low_time, up_time in load_query_boxes(query_file).tolist():
+        estimate, lower, upper = bounded_box_count(grid, low_x, up_x, low_y, up_y, low_time, up_time, target_error)
+        bounded_results.append({'estimate': estimate, 'lower': lower, 'upper': upper})
 
-    cell_min_lat = min_lat + (lat_partition / 100) * (max_lat - min_lat)
-    cell_max_lat = min_lat + ((lat_partition + 1) / 100) * (max_lat - min_lat)
+    return bounded_results
 
-    cell_min_time = min_time + (time_partition / 100) * (max_time - min_time)
-    cell_max_time = min_time + ((time_partition + 1) / 100) * (max_time - min_time)
 
-    # Calculate the overlap ratio of longitude, latitude, and time
-    lon_overlap = max(0, min(cell_max_lon, up_x) - max(cell_min_lon, low_x)) / (cell_max_lon - cell_min_lon)
-    lat_overlap = max(0, min(cell_max_lat, up_y) - max(cell_min_lat, low_y)) / (cell_max_lat - cell_min_lat)
-    time_overlap = max(0, min(cell_max_time, up_time) - max(cell_min_time, low_time)) / (cell_max_time - cell_min_time)
+# aggregate query: SUM / AVG / MIN / MAX of Total_Amt in the query range
+def aggregate_query_processing(grid, query_file, approximate=False):
+    aggregate_results = []
 
-    # Calculate the total overlap ratio f
-    f = lon_overlap * lat_overlap * time_overlap
+    for low_x, up_x, low_y, up_y, low_time, up_time in load_query_boxes(query_file).tolist():
+        if approximate:
+            result = approximate_aggregate(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+        else:
+            result = exact_aggregate(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+        aggregate_results.append(result)
 
-    # Check if it fully or partially includes
-    if f == 1:
-        return "fully_inside", f
-    elif f > 0:
-        return "partially_inside", f
-    else:
-        return "outside", 0
+    return aggregate_results
+
+
+def exact_aggregate(grid, low_x, up_x, low_y, up_y, low_time, up_time):
+    ranges = get_cell_ranges(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if not all(first <= last for first, last, _, _ in ranges):
+        return amount_aggregate(0, 0.0, None, None)
+
+    # fully inside cells: precomputed per-cell aggregates, no records are read
+    count = inside_count(grid, ranges)
+    total, low, high = 0.0, np.inf, -np.inf
+    if all(inner_first <= inner_last for _, _, inner_first, inner_last in ranges):
+        inside = tuple(slice(inner_first, inner_last + 1) for _, _, inner_first, inner_last in ranges)
+        total = float(grid['cell_amount_sum'][inside].sum())
+        low = float(grid['cell_amount_min'][inside].min())
+        high = float(grid['cell_amount_max'][inside].max())
+
+    # partially inside cells: Total_Amt of the records that meet the query criteria
+    indices = record_indices(grid, shell_cell_ids(grid, ranges))
+    amount = grid['amount'][indices[match_records(grid, indices, low_x, up_x, low_y, up_y, low_time, up_time)]]
+    count += len(amount)
+    total += float(amount.sum())
+    low = min(low, float(amount.min(initial=np.inf)))
+    high = max(high, float(amount.max(initial=-np.inf)))
+
+    return amount_aggregate(count, total, low, high)
+
+
+def approximate_aggregate(grid, low_x, up_x, low_y, up_y, low_time, up_time):
+    block, f = get_cell_status_and_fraction(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if block is None:
+        return amount_aggregate(0, 0.0, None, None)
+
+    # partially inside cells add f * count and f * sum, min / max are taken over every cell the query touches
+    touched = f > 0
+    count = float((f * grid['cell_count'][block]).sum())
+    total = float((f * grid['cell_amount_sum'][block]).sum())
+    low = float(grid['cell_amount_min'][block][touched].min(initial=np.inf))
+    high = float(grid['cell_amount_max'][block][touched].max(initial=-np.inf))
+
+    result = amount_aggregate(count, total, low, high)
+    result['count'] = round(count)
+    return result
+
+
+def combine_counts(part_results):
+    # answers of the base grid and the appended parts, added up per query
+    return [sum(answers) for answers in zip(*part_results)]
+
+
+def combine_bounds(part_results):
+    # estimates and interval ends add up, each part meets the relative error so the sum does too
+    return [{name: sum(answer[name] for answer in answers) for name in ('estimate', 'lower', 'upper')}
+            for answers in zip(*part_results)]
+
+
+def combine_aggregates(part_results):
+    combined = []
+    for answers in zip(*part_results):
+        lows = [answer['min'] for answer in answers if answer['min'] is not None]
+        highs = [answer['max'] for answer in answers if answer['max'] is not None]
+        combined.append(amount_aggregate(sum(answer['count'] for answer in answers),
+                                         sum(answer['sum'] for answer in answers),
+                                         min(lows) if lows else None, max(highs) if highs else None))
+    return combined
+
+
+def write_aggregates_to_file(results, output_file, total_runtime):
+    with open(output_file, 'w') as f:
+        for i, result in enumerate(results):
+            f.write(f"Query {i + 1} Results:\n")
+            f.write(f"Total Matching Records: {result['count']}\n")
+            f.write(f"SUM(Total_Amt): {result['sum']:.2f}\n")
+            if result['avg'] is None:
+                f.write("AVG / MIN / MAX(Total_Amt): no matching records\n")
+            else:
+                f.write(f"AVG(Total_Amt): {result['avg']:.2f}\n")
+                f.write(f"MIN(Total_Amt): {result['min']:.2f}\n")
+                f.write(f"MAX(Total_Amt): {result['max']:.2f}\n")
+            f.write("\n\n")
+        f.write(f"Total runtime: {total_runtime:.2f} seconds\n")
+
+
+def write_bounds_to_file(results, output_file, total_runtime):
+    with open(output_file, 'w') as f:
+        for i, result in enumerate(results):
+            f.write(f"Query {i + 1} Results:\n")
+            f.write(f"Estimated Matching Records: {round(result['estimate'])}\n")
+            f.write(f"Exact count within: [{result['lower']}, {result['upper']}]\n")
+            f.write("\n\n")
+        f.write(f"Total runtime: {total_runtime:.2f} seconds\n")
 
 
 def write_results_to_file(results, output_file, total_runtime):
@@ -207,36 +322,97 @@ def write_results_to_file(results, output_file, total_runtime):
 
 
 def main():
-    # load grid cells
-    grid, (min_lon, max_lon, min_lat, max_lat, min_time, max_time) = load_grid_from_file('../Datasets/grid.txt')
-
-    # 0 -> exact query，1 -> approximate query
-    user_input = input("Enter 1 for exact query processing or 0 for approximate query processing: ")
+    # load grid cells, the base grid and every batch appended by append_grid.py
+    grid_parts = load_grid_parts('../Datasets/grid.bin')
+    min_lon, max_lon, min_lat, max_lat, min_time, max_time = grid_parts[0]['bounds']
+
+    # 0 -> approximate query，1 -> exact query，2 -> exact query, all queries in one batch,
+    # 3 -> exact query on several processes, 4 / 5 -> exact / approximate Total_Amt aggregates,
+    # 6 -> approximate query with an error bound, 7 -> exact query through the result cache
+    user_input = input("Enter 1 for exact query processing, 2 for batch exact query processing, "
+                       "3 for parallel exact query processing, 4 for exact aggregate query processing, "
+                       "5 for approximate aggregate query processing, 6 for error-bounded approximate query "
+                       "processing, 7 for cached exact query processing or 0 for approximate query processing: ")
 
     # check the input
     if user_input == "1":
         print("Running exact query processing...")
         start_time = time.time()  # start time
-        results = exact_query_processing(grid, '../Datasets/queries.txt', min_lon, max_lon, min_lat, max_lat, min_time,
-                                         max_time)
+        results = combine_counts([exact_query_processing(grid, '../Datasets/queries.txt', min_lon, max_lon, min_lat,
+                                                         max_lat, min_time, max_time) for grid in grid_parts])
+        end_time = time.time()  # end time
+        total_runtime = end_time - start_time
+        # save the results
+        output_file = '../Datasets/exact_query_results.txt'
+        write_results_to_file(results, output_file, total_runtime)
+    elif user_input == "2":
+        print("Running batch exact query processing...")
+        start_time = time.time()  # start time
+        results = combine_counts([exact_query_processing_batch(grid, '../Datasets/queries.txt') for grid in grid_parts])
+        end_time = time.time()  # end time
+        total_runtime = end_time - start_time
+        # save the results
+        output_file = '../Datasets/exact_query_results.txt'
+        write_results_to_file(results, output_file, total_runtime)
+    elif user_input == "3":
+        workers = int(input("Enter the number of worker processes: "))
+        print("Running parallel exact query processing...")
+        start_time = time.time()  # start time
+        results = combine_counts([exact_query_processing_parallel(part_file, '../Datasets/queries.txt', workers)
+                                  for part_file in grid_part_files('../Datasets/grid.bin')])
+        end_time = time.time()  # end time
+        total_runtime = end_time - start_time
+        # save the results
+        output_file = '../Datasets/exact_query_results.txt'
+        write_results_to_file(results, output_file, total_runtime)
+    elif user_input in ("4", "5"):
+        approximate = user_input == "5"
+        print(f"Running {'approximate' if approximate else 'exact'} aggregate query processing...")
+        start_time = time.time()  # start time
+        results = combine_aggregates([aggregate_query_processing(grid, '../Datasets/queries.txt', approximate)
+                                      for grid in grid_parts])
+        end_time = time.time()  # end time
+        total_runtime = end_time - start_time
+        # save the results
+        output_file = f"../Datasets/{'approximate' if approximate else 'exact'}_aggregate_results.txt"
+        write_aggregates_to_file(results, output_file, total_runtime)
+    elif user_input == "6":
+        target_error = float(input("Enter the target relative error (e.g. 0.05, 0 for exact): "))
+        print("Running error-bounded approximate query processing...")
+        start_time = time.time()  # start time
+        results = combine_bounds([bounded_query_processing(grid, '../Datasets/queries.txt', target_error)
+                                  for grid in grid_parts])
+        end_time = time.time()  # end time
+        total_runtime = end_time - start_time
+        # save the results
+        output_file = '../Datasets/bounded_query_results.txt'
+        write_bounds_to_file(results, output_file, total_runtime)
+    elif user_input == "7":
+        print("Running cached exact query processing...")
+        caches = [QueryCache(grid) for grid in grid_parts]
+        start_time = time.time()  # start time
+        results = combine_counts([cached_query_processing(cache, '../Datasets/queries.txt') for cache in caches])
         end_time = time.time()  # end time
         total_runtime = end_time - start_time
+        for cache in caches:
+            print(cache.summary())
         # save the results
         output_file = '../Datasets/exact_query_results.txt'
         write_results_to_file(results, output_file, total_runtime)
     elif user_input == "0":
         print("Running approximate query processing...")
         start_time = time.time()  # start time
-        results = approximate_query_processing(grid, '../Datasets/queries.txt', min_lon, max_lon, min_lat, max_lat,
-                                               min_time, max_time)
+        results = combine_counts([approximate_query_processing(grid, '../Datasets/queries.txt', min_lon, max_lon,
+                                                               min_lat, max_lat, min_time, max_time) for grid in grid_parts])
         end_time = time.time()  # end time
         total_runtime = end_time - start_time
         # save the results
         output_file = '../Datasets/approximate_query_results.txt'
         write_results_to_file(results, output_file, total_runtime)
     else:
-        print("Invalid input. Please enter 0 or 1.")
+        print("Invalid input. Please enter a number from 0 to 7.")
 
 
-# main function
-main()
+# main function, guarded so that worker processes can import this file
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime
-from rtree import index
 import time
 
+from grid_file import (block_cell_ids, get_cell_status, get_cell_status_and_fraction, load_grid_file,
+                       load_grid_parts, match_records, record_indices)
+from Task2 import approximate_estimate, combine_counts, exact_counts_batch, load_query_boxes
+
 # 设置 pandas 显示选项，确保显示所有列
 pd.set_option('display.max_columns', None)  # 显示所有列
 pd.set_option('display.expand_frame_repr', False)  # 防止换行显示
@@ -10,252 +14,162 @@ pd.set_option('display.max_rows', 50)  # 如果你想显示更多行，可以修
 
 
 def load_grid_from_file(filename):
-    grid = {}  # 用于存储所有非空的网格单元数据
-    min_lon, max_lon = None, None
-    min_lat, max_lat = None, None
-    min_time, max_time = None, None
-
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-
-        # 读取全局的最小值和最大值
-        min_lon, max_lon = map(float, lines[0].strip().split(','))
-        min_lat, max_lat = map(float, lines[1].strip().split(','))
-        min_time, max_time = map(float, lines[2].strip().split(','))
-
-        # 逐行解析剩下的网格数据
-        i = 3
-        while i < len(lines):
-            # 读取网格单元的坐标 (x, y, t)
-            cell_coords = lines[i].strip()
-            cell_x, cell_y, cell_t = map(int, cell_coords.strip('()').split(','))
-            cell_key = (cell_x, cell_y, cell_t)
-
-            # 读取该单元格的总金额
-            total_amt_in_cell = int(lines[i + 1].strip())
-
-            # 初始化该网格单元的记录列表
-            grid[cell_key] = {
-                'count': total_amt_in_cell,  # total amount
-                'records': []
-            }
-
-            # 从 i + 2 开始读取所有属于该网格单元的记录
-            i += 2
-            while i < len(lines) and not lines[i].startswith('('):
-                # 每一行是 x, y, timestamp, Total_Amt
-                x, y, timestamp, total_amt = map(float, lines[i].strip().split(','))
-                grid[cell_key]['records'].append((x, y, timestamp, total_amt))
-                i += 1  # 继续读取下一行
-
-            # 注意此时 i 指向下一个网格单元的坐标行，继续循环处理
-        return grid, (min_lon, max_lon, min_lat, max_lat, min_time, max_time)
-
-
-# exact query
-def exact_query_processing(grid, query_file, min_lon, max_lon, min_lat, max_lat, min_time, max_time):
-    exact_results = []  # 用于存储每次查询的结果
-
-    # 读取查询文件
-    with open(query_file, 'r') as f:
-        queries = f.readlines()
-
-    for query in queries:
-        # 解析查询条件：low_x, up_x, low_y, up_y, low_datetime, up_datetime
-        query_parts = query.strip().split(',')
-        low_x, up_x = float(query_parts[0]), float(query_parts[1])
-        low_y, up_y = float(query_parts[2]), float(query_parts[3])
-        low_time = datetime.strptime(query_parts[4], "%Y-%m-%d %H:%M:%S").timestamp()
-        up_time = datetime.strptime(query_parts[5], "%Y-%m-%d %H:%M:%S").timestamp()
-
-        exact_query_result = {
-            'count': 0,  # 符合条件的数据数目
-            'records': []  # 符合条件的每条数据
-        }
-
-        # 查询的总金额初始化为 0
-        total_amount = 0
-
-        # 遍历网格单元
-        for cell_key, cell_data in grid.items():
-            lon_partition, lat_partition, time_partition = cell_key
-
-            # 检查网格单元是否与查询的地理范围和时间范围相交
-            cell_status = get_cell_status(cell_key, low_x, up_x, low_y, up_y, low_time, up_time,
-                                          min_lon, max_lon, min_lat, max_lat, min_time, max_time)
-
-            if cell_status == "fully_inside":
-                # fully in
-                exact_query_result['count'] += cell_data['count']
-                exact_query_result['records'].extend(cell_data['records'])
-            elif cell_status == "partially_inside":
-                # partially in
-                for record in cell_data['records']:
-                    lon, lat, timestamp, amount = record
-                    # check each
-                    if low_x <= lon <= up_x and low_y <= lat <= up_y and low_time <= timestamp <= up_time:
-                        exact_query_result['count'] += 1
-                        exact_query_result['records'].append(record)
-
-        # 保存每次查询的结果
-        exact_results.append(exact_query_result)
-
-    return exact_results
-
-
-def get_cell_status(cell_key, low_x, up_x, low_y, up_y, low_time, up_time,
-                    min_lon, max_lon, min_lat, max_lat, min_time, max_time):
-    lon_partition, lat_partition, time_partition = cell_key
-
-    # 根据分区数计算该单元的经度、纬度、时间范围
-    cell_min_lon = min_lon + (lon_partition / 100) * (max_lon - min_lon)
-    cell_max_lon = min_lon + ((lon_partition + 1) / 100) * (max_lon - min_lon)
-
-    cell_min_lat = min_lat + (lat_partition / 100) * (max_lat - min_lat)
-    cell_max_lat = min_lat + ((lat_partition + 1) / 100) * (max_lat - min_lat)
-
-    cell_min_time = min_time + (time_partition / 100) * (max_time - min_time)
-    cell_max_time = min_time + ((time_partition + 1) / 100) * (max_time - min_time)
-
-    # 检查网格单元是否完全包含在查询范围内
-    if (low_x <= cell_min_lon and cell_max_lon <= up_x and
-            low_y <= cell_min_lat and cell_max_lat <= up_y and
-            low_time <= cell_min_time and cell_max_time <= up_time):
-        return "fully_inside"
-
-    # 检查网格单元是否部分包含在查询范围内
-    if (cell_max_lon >= low_x and cell_min_lon <= up_x and
-            cell_max_lat >= low_y and cell_min_lat <= up_y and
-            cell_max_time >= low_time and cell_min_time <= up_time):
-        return "partially_inside"
-
-    # 网格单元不在查询范围内
-    return "outside"
+    # the sections are memory-mapped, records are only read when a query touches them
+    grid = load_grid_file(filename)
+    min_lon, max_lon, min_lat, max_lat, min_time, max_time = grid['bounds']
+    return grid, (min_lon, max_lon, min_lat, max_lat, min_time, max_time)
 
 
-# approximate query
-def approximate_query_processing(grid, query_file, min_lon, max_lon, min_lat, max_lat, min_time, max_time):
-    approximate_results = []  # 用于存储每次查询的结果
-
-    # 读取查询文件
-    with open(query_file, 'r') as f:
-        queries = f.readlines()
-
-    for query in queries:
-        # 解析查询条件：low_x, up_x, low_y, up_y, low_datetime, up_datetime
-        query_parts = query.strip().split(',')
-        low_x, up_x = float(query_parts[0]), float(query_parts[1])
-        low_y, up_y = float(query_parts[2]), float(query_parts[3])
-        low_time = datetime.strptime(query_parts[4], "%Y-%m-%d %H:%M:%S").timestamp()
-        up_time = datetime.strptime(query_parts[5], "%Y-%m-%d %H:%M:%S").timestamp()
-
-        approximate_query_result = {
-            'count': 0,  # 符合条件的数据数目
-            'records': []  # 符合条件的每条数据
-        }
-
-        # 查询的总金额初始化为 0
-        total_amount = 0
-
-        # 遍历网格单元
-        for cell_key, cell_data in grid.items():
-            lon_partition, lat_partition, time_partition = cell_key
-
-            # 检查网格单元是否与查询的地理范围和时间范围相交
-            cell_status, f = get_cell_status_and_fraction(cell_key, low_x, up_x, low_y, up_y, low_time, up_time,
-                                                          min_lon, max_lon, min_lat, max_lat, min_time, max_time)
-
-            if cell_status == "fully_inside":
-                # 如果网格单元完全包含在查询范围内，直接使用 Total_Amt_in_cell
-                approximate_query_result['count'] += cell_data['count']
-                approximate_query_result['records'].extend(cell_data['records'])
-            elif cell_status == "partially_inside":
-                # 如果部分包含，则将 f * Total_Amt_in_cell 加入结果
-                approximate_query_result['count'] += f * cell_data['count']
-                approximate_query_result['records'].append(f"This cell ({lon_partition}, {lat_partition}, {time_partition}) is partially_inside.")
-        approximate_query_result['count'] = round(approximate_query_result['count'])
-        # 保存每次查询的结果
-        approximate_results.append(approximate_query_result)
-
-    return approximate_results
-
-
-def get_cell_status_and_fraction(cell_key, low_x, up_x, low_y, up_y, low_time, up_time,
-                                 min_lon, max_lon, min_lat, max_lat, min_time, max_time):
-    lon_partition, lat_partition, time_partition = cell_key
-
-    # 根据分区数计算该单元的经度、纬度、时间范围
-    cell_min_lon = min_lon + (lon_partition / 100) * (max_lon - min_lon)
-    cell_max_lon = min_lon + ((lon_partition + 1) / 100) * (max_lon - min_lon)
-
-    cell_min_lat = min_lat + (lat_partition / 100) * (max_lat - min_lat)
-    cell_max_lat = min_lat + ((lat_partition + 1) / 100) * (max_lat - min_lat)
-
-    cell_min_time = min_time + (time_partition / 100) * (max_time - min_time)
-    cell_max_time = min_time + ((time_partition + 1) / 100) * (max_time - min_time)
-
-    # 计算经度、纬度和时间的重叠比例
-    lon_overlap = max(0, min(cell_max_lon, up_x) - max(cell_min_lon, low_x)) / (cell_max_lon - cell_min_lon)
-    lat_overlap = max(0, min(cell_max_lat, up_y) - max(cell_min_lat, low_y)) / (cell_max_lat - cell_min_lat)
-    time_overlap = max(0, min(cell_max_time, up_time) - max(cell_min_time, low_time)) / (cell_max_time - cell_min_time)
-
-    # 计算总的重叠比例 f
-    f = lon_overlap * lat_overlap * time_overlap
-
-    # 检查是否完全包含或部分包含
-    if f == 1:
-        return "fully_inside", f
-    elif f > 0:
-        return "partially_inside", f
-    else:
-        return "outside", 0
+# 结果的二进制输出: 设为 True 时, 所有匹配的记录还会写到和文本报告同名的 .npy 文件
+# (字段 query, lon, lat, time, amount), 可以用 np.load(..., mmap_mode='r') 读取
+save_npy = False
+
+RECORD_DTYPE = np.dtype([('query', '<i4'), ('lon', '<f8'), ('lat', '<f8'), ('time', '<i8'), ('amount', '<f8')])
+
+
+def get_columns(grid, indices):
+    # (lon, lat, timestamp, amount) columns of the given records
+    return grid['lon'][indices], grid['lat'][indices], grid['time'][indices], grid['amount'][indices]
+
+
+# exact query, the matching records of one query as a stream of column slices
+def exact_record_slices(grid, low_x, up_x, low_y, up_y, low_time, up_time, chunk_records=1 << 16):
+    # 只遍历与查询范围相交的网格单元
+    block, fully_inside = get_cell_status(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if block is None:
+        return
 
+    # cells in file order, the order record_indices reads them in
+    cell_count = grid['cell_count'][block]
+    overlap = cell_count > 0
+    ids = block_cell_ids(grid, block, overlap)
+    order = np.argsort(grid['cell_start'][ids], kind='stable')
+    ids, inside, counts = ids[order], fully_inside[overlap][order], cell_count[overlap][order]
+
+    # runs of whole cells with about chunk_records records each, so only one run is in memory at a time
+    runs = np.split(np.arange(len(ids)), np.flatnonzero(np.diff(np.cumsum(counts) // chunk_records)) + 1)
+    for run in runs:
+        indices = record_indices(grid, ids[run])
+
+        # fully in: keep every record, partially in: check each
+        keep = np.repeat(inside[run], counts[run])
+        keep |= match_records(grid, indices, low_x, up_x, low_y, up_y, low_time, up_time)
+        if keep.any():
+            yield get_columns(grid, indices[keep])
+
+
+# approximate query
+def approximate_count(grid, low_x, up_x, low_y, up_y, low_time, up_time):
+    # estimated count, same estimate as Task2 (samples, histograms or f * count, whatever the grid has),
+    # and the number of records of the fully inside cells (the records that are listed)
+    block, f = get_cell_status_and_fraction(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if block is None:
+        return 0, 0
+    cell_count = grid['cell_count'][block]
+    estimate = approximate_estimate(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    return round(estimate), int(cell_count[(cell_count > 0) & (f == 1)].sum())
+
+
+def approximate_record_slices(grid, low_x, up_x, low_y, up_y, low_time, up_time):
+    # 只遍历与查询范围相交的网格单元, 按 (x, y, t) 顺序
+    block, f = get_cell_status_and_fraction(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if block is None:
+        return
+
+    cell_count = grid['cell_count'][block]
+    overlap = (cell_count > 0) & (f > 0)
+    cell_ids = block_cell_ids(grid, block, overlap)
+
+    for cell_id, cell_index in zip(cell_ids.tolist(), zip(*np.nonzero(overlap))):
+        if f[cell_index] == 1:
+            # 如果网格单元完全包含在查询范围内，直接输出这个网格单元的记录
+            start = int(grid['cell_start'][cell_id])
+            end = start + int(cell_count[cell_index])
+            yield grid['lon'][start:end], grid['lat'][start:end], grid['time'][start:end], grid['amount'][start:end]
+        else:
+            # 如果部分包含，只输出提示
+            lon_partition, lat_partition, time_partition = (int(i) + b.start for i, b in zip(cell_index, block))
+            yield f"This cell ({lon_partition}, {lat_partition}, {time_partition}) is partially_inside."
+
+
+def query_answers(grid_parts, boxes, approximate):
+    # count, number of listed records and the record stream of every query, over all grid parts.
+    # The counts are computed first, the records are only read while they are written
+    answers = []
+    for box in boxes.tolist():
+        if approximate:
+            counts = [approximate_count(grid, *box) for grid in grid_parts]
+            count, num_records = sum(c for c, _ in counts), sum(n for _, n in counts)
+        else:
+            count = num_records = None
+        answers.append([count, num_records, box])
+    if not approximate:
+        exact = combine_counts([exact_counts_batch(grid, boxes).tolist() for grid in grid_parts])
+        for answer, count in zip(answers, exact):
+            answer[0] = answer[1] = count
+
+    record_slices = approximate_record_slices if approximate else exact_record_slices
+    for count, num_records, box in answers:
+        yield count, num_records, part_slices(grid_parts, record_slices, box)
+
+
+def part_slices(grid_parts, record_slices, box):
+    # 结果按 grid part 的顺序连接
+    for grid in grid_parts:
+        yield from record_slices(grid, *box)
+
+
+def write_results_to_file(answers, output_file, start_time, npy_file=None):
+    # streamed: every record slice is formatted and written as soon as it is read
+    answers = list(answers)
+    records = None
+    if npy_file is not None:
+        records = np.lib.format.open_memmap(npy_file, mode='w+', dtype=RECORD_DTYPE,
+                                            shape=(sum(num_records for _, num_records, _ in answers),))
+    position = 0
 
-def write_results_to_file(results, output_file, total_runtime):
     with open(output_file, 'w') as f:
-        for i, result in enumerate(results):
+        for i, (count, _, slices) in enumerate(answers):
             f.write(f"Query {i + 1} Results:\n")
-            f.write(f"Total Matching Records: {result['count']}\n")
+            f.write(f"Total Matching Records: {count}\n")
             f.write("Matching Records (lon, lat, timestamp, amount):\n")
-            for record in result['records']:
-                if isinstance(record, str):  # 如果是字符串类型，直接写入字符串（用于approximate query部分包含的情况）
-                    f.write(f"{record}\n")
-                else:
-                    lon, lat, timestamp, amount = record
-                    f.write(f"{lon}, {lat}, {datetime.fromtimestamp(timestamp)}, {amount}\n")
+            for part in slices:
+                if isinstance(part, str):  # 如果是字符串类型，直接写入字符串（用于approximate query部分包含的情况）
+                    f.write(f"{part}\n")
+                    continue
+                lon, lat, timestamp, amount = part
+                f.writelines(f"{x}, {y}, {datetime.fromtimestamp(t)}, {a}\n"
+                             for x, y, t, a in zip(lon.tolist(), lat.tolist(), timestamp.tolist(), amount.tolist()))
+                if records is not None:
+                    block = records[position:position + len(lon)]
+                    block['query'], block['lon'], block['lat'], block['time'], block['amount'] = i + 1, lon, lat, timestamp, amount
+                    position += len(lon)
             f.write("\n")
-        f.write(f"Total runtime: {total_runtime:.2f} seconds\n")
+        f.write(f"Total runtime: {time.time() - start_time:.2f} seconds\n")
+
+    if records is not None:
+        records.flush()
 
 
 def main():
-    # 使用函数从文件中加载数据
-    grid, (min_lon, max_lon, min_lat, max_lat, min_time, max_time) = load_grid_from_file('../Datasets/grid.txt')
+    # 使用函数从文件中加载数据, base grid 和 append_grid.py 追加的每个 batch
+    grid_parts = load_grid_parts('../Datasets/grid.bin')
 
     # 让用户输入选择：0表示exact query，1表示approximate query
     user_input = input("Enter 1 for exact query processing or 0 for approximate query processing: ")
 
-    # 检查用户输入并调用相应的处理函数
-    if user_input == "1":
-        print("Running exact query processing...")
-        start_time = time.time()  # 记录开始时间
-        results = exact_query_processing(grid, '../Datasets/queries.txt', min_lon, max_lon, min_lat, max_lat, min_time, max_time)
-        end_time = time.time()  # 记录结束时间
-        total_runtime = end_time - start_time
-        # save查询结果
-        output_file = '../Datasets/exact_query_results_Adv.txt'
-        write_results_to_file(results, output_file, total_runtime)
-    elif user_input == "0":
-        print("Running approximate query processing...")
+    # 检查用户输入并调用相应的处理函数, 运行时间包括写结果文件
+    if user_input in ("1", "0"):
+        approximate = user_input == "0"
+        print(f"Running {'approximate' if approximate else 'exact'} query processing...")
         start_time = time.time()  # 记录开始时间
-        results = approximate_query_processing(grid, '../Datasets/queries.txt', min_lon, max_lon, min_lat, max_lat, min_time, max_time)
-        end_time = time.time()  # 记录结束时间
-        total_runtime = end_time - start_time
+        answers = query_answers(grid_parts, load_query_boxes('../Datasets/queries.txt'), approximate)
         # save查询结果
-        output_file = '../Datasets/approximate_query_results_Adv.txt'
-        write_results_to_file(results, output_file, total_runtime)
+        output_file = f"../Datasets/{'approximate' if approximate else 'exact'}_query_results_Adv.txt"
+        write_results_to_file(answers, output_file, start_time, output_file[:-4] + '.npy' if save_npy else None)
     else:
         print("Invalid input. Please enter 0 or 1.")
 
 
 # 调用主函数
-main()
\ No newline at end of file
+main()
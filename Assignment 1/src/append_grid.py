@@ -0,0 +1,107 @@
+import os
+import time
+from functools import reduce
+
+import numpy as np
+
+from grid_file import (GRID_SIZE, build_grid_file, extend_edges, get_partition_by_edges, grid_part_files,
+                       load_grid_file, load_grid_parts, load_records, read_grid_header, uniform_edges)
+
+# Incremental ingestion: a new batch of cleaned trips (same columns as subset.parquet) is written as a
+# delta grid next to grid.bin (grid.bin.delta1, grid.bin.delta2, ...). The delta uses the cells of the
+# existing grid, cut down to the block of cells the batch touches and without a prefix count cube, so the
+# file and the dense per-cell arrays of the delta scale with the batch, not with the grid or the history.
+# Records outside the current bounds go to overflow cells added at the ends of the affected axis.
+# Task2 answers every query on all parts and adds the answers up.
+# compact() merges the parts back into one grid.bin when there are too many of them.
+
+grid_path = '../Datasets/grid.bin'
+
+
+def bounds_of(edges):
+    return (edges[0][0], edges[0][-1], edges[1][0], edges[1][-1], edges[2][0], edges[2][-1])
+
+
+def part_edges(filename):
+    # cell edges of one part, read from its header, uniform grids only store their bounds and shape
+    header = read_grid_header(filename)
+    if 'edges' in header:
+        return tuple(np.array(axis_edges, dtype=np.float64) for axis_edges in header['edges'])
+    return uniform_edges(header['bounds'], header.get('shape', (GRID_SIZE,) * 3))
+
+
+def current_edges(grid_path):
+    # every cell added so far: a delta only stores the edges of its block, cut from the edges of its time,
+    # so the union over the parts gives the base cells with all the overflow cells
+    edges = [part_edges(name) for name in grid_part_files(grid_path)]
+    return tuple(reduce(np.union1d, axis_edges) for axis_edges in zip(*edges))
+
+
+def sample_size_of(grid):
+    # per-cell sample size the grid was built with, 0 without samples
+    return int(grid['sample_size'][0]) if 'sample_size' in grid else 0
+
+
+def histogram_bins_of(grid):
+    # bins of the per-cell histograms the grid was built with, 0 without histograms
+    return int(grid['hist_lon'].shape[1]) if 'hist_lon' in grid else 0
+
+
+def append_batch(grid_path, batch_path):
+    parts = grid_part_files(grid_path)
+
+    # layout, samples and histograms like the newest part
+    latest = load_grid_file(parts[-1])
+    lon, lat, timestamps, amount = load_records(batch_path)
+
+    edges = tuple(extend_edges(axis_edges, values)
+                  for axis_edges, values in zip(current_edges(grid_path), (lon, lat, timestamps)))
+    partitions = tuple(get_partition_by_edges(values, axis_edges) for values, axis_edges in zip((lon, lat, timestamps), edges))
+
+    # only the block of cells between the lowest and the highest cell of the batch along each axis
+    first = [int(partition.min()) if len(partition) else 0 for partition in partitions]
+    last = [int(partition.max()) if len(partition) else 0 for partition in partitions]
+    edges = tuple(axis_edges[low:high + 2] for axis_edges, low, high in zip(edges, first, last))
+    partitions = tuple(partition - low for partition, low in zip(partitions, first))
+    shape = tuple(len(axis_edges) - 1 for axis_edges in edges)
+
+    delta_path = f"{grid_path}.delta{len(parts)}"
+    build_grid_file(delta_path, lon, lat, timestamps, amount, bounds_of(edges), partitions, shape, edges,
+                    prefix_cube=False, layout=latest['layout'], sample_size=sample_size_of(latest),
+                    histogram_bins=histogram_bins_of(latest))
+    return delta_path, len(lon)
+
+
+def compact(grid_path):
+    # one grid.bin with the newest edges, every record re-assigned to them
+    parts = load_grid_parts(grid_path)
+    edges = current_edges(grid_path)
+    lon, lat, timestamps, amount = (np.concatenate([np.asarray(part[name]) for part in parts])
+                                    for name in ('lon', 'lat', 'time', 'amount'))
+
+    partitions = tuple(get_partition_by_edges(values, axis_edges) for values, axis_edges in zip((lon, lat, timestamps), edges))
+    shape = tuple(len(axis_edges) - 1 for axis_edges in edges)
+
+    build_grid_file(grid_path + '.tmp', lon, lat, timestamps, amount, bounds_of(edges), partitions, shape, edges,
+                    layout=parts[0]['layout'], sample_size=sample_size_of(parts[0]),
+                    histogram_bins=histogram_bins_of(parts[0]))
+    os.replace(grid_path + '.tmp', grid_path)
+    for name in grid_part_files(grid_path)[1:]:
+        os.remove(name)
+    return len(lon)
+
+
+if __name__ == "__main__":
+    user_input = input("Enter 1 to append a parquet batch or 0 to compact the grid: ")
+
+    if user_input == "1":
+        batch_path = input("Enter the parquet file of the new batch: ")
+        start_time = time.time()
+        delta_path, num_records = append_batch(grid_path, batch_path)
+        print(f"Appended {num_records} records to '{delta_path}' in {time.time() - start_time:.2f} seconds")
+    elif user_input == "0":
+        start_time = time.time()
+        num_records = compact(grid_path)
+        print(f"Compacted {num_records} records into '{grid_path}' in {time.time() - start_time:.2f} seconds")
+    else:
+        print("Invalid input. Please enter 0 or 1.")
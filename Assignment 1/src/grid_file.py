@@ -0,0 +1,759 @@
+import glob
+import json
+import math
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Binary grid file (grid.bin), replaces the text grid.txt
+#
+#   magic        8 bytes  b'TAXIGRID'
+#   header_len   uint32   length of the JSON header
+#   header       JSON     bounds, number of cells/records and the section table
+#   sections     raw little-endian arrays, each aligned to 64 bytes
+#
+# sections:
+#   cells      (num_cells, 3) int32    (x, y, t) cell keys, sorted in the layout order of the header
+#   offsets    (num_cells,)   int64    first record of the cell
+#   counts     (num_cells,)   int64    records in the cell
+#   lon, lat, amount  (num_records,) float64, records grouped by cell
+#   time              (num_records,) int64 epoch seconds (float64 in older files, dtype is in the header)
+#
+# optional sections: per-cell Total_Amt aggregates, the prefix count cube, per-cell samples
+# (sample_size, sample_offsets / sample_counts per cell, sample_lon / sample_lat / sample_time grouped by cell)
+# and per-cell marginal histograms (hist_lon / hist_lat / hist_time, (num_cells, bins) int32)
+
+MAGIC = b'TAXIGRID'
+VERSION = 1
+ALIGN = 64
+
+COLUMNS = ('lon', 'lat', 'time', 'amount')
+COLUMN_DTYPES = {'lon': '<f8', 'lat': '<f8', 'time': '<i8', 'amount': '<f8'}
+
+GRID_SIZE = 100
+
+# order of the cell blocks in the file: 'linear' is sorted (x, y, t), 'morton' follows the Z-order curve so
+# cells that are close in all three axes are also close on disk and a box reads a few long runs
+LAYOUTS = ('linear', 'morton')
+
+
+def _align(pos):
+    return (pos + ALIGN - 1) // ALIGN * ALIGN
+
+
+# which grid, for a whole column of values
+def get_partition(values, min_value, max_value, grid_size=GRID_SIZE):
+    return (grid_size * (values - min_value) / (max_value - min_value + 1e-6)).astype(np.int64)  # protect from overflow
+
+
+def epoch_seconds(pickup):
+    # whole column of pickup datetimes to int64 epoch seconds in one conversion, no per-record .timestamp()
+    return pd.to_datetime(pickup).to_numpy(dtype='datetime64[s]').astype(np.int64)
+
+
+@lru_cache(maxsize=4096)
+def parse_time(text):
+    # query bound to epoch seconds: a number is taken as it is, a 'YYYY-MM-DD HH:MM:SS' string is parsed
+    # like datetime.strptime(...).timestamp(), the same bounds repeat a lot across queries so they are cached
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def load_records(file_path):
+    # lon, lat, pickup timestamp and Total_Amt columns of a cleaned parquet file (subset.parquet or a new batch),
+    # rows without a pickup time cannot be placed on the time axis and are left out
+    df = pd.read_parquet(file_path, columns=['Trip_Pickup_DateTime', 'Start_Lon', 'Start_Lat', 'Total_Amt'])
+    df['Trip_Pickup_DateTime'] = pd.to_datetime(df['Trip_Pickup_DateTime'])
+    df = df.dropna(subset=['Trip_Pickup_DateTime'])
+    return (df['Start_Lon'].to_numpy(dtype=np.float64), df['Start_Lat'].to_numpy(dtype=np.float64),
+            epoch_seconds(df['Trip_Pickup_DateTime']), df['Total_Amt'].to_numpy(dtype=np.float64))
+
+
+def quantile_edges(values, grid_size=GRID_SIZE):
+    # equi-depth bucket boundaries: every bucket holds about the same number of records.
+    # Repeated quantiles (many equal values) are merged, so an axis can end up with fewer buckets
+    edges = np.unique(np.quantile(values, np.linspace(0, 1, grid_size + 1)))
+    if len(edges) == 1:
+        edges = np.append(edges, np.nextafter(edges[0], np.inf))
+    return edges
+
+
+def extend_edges(edges, values):
+    # overflow cells for values below edges[0] / above edges[-1], about as wide as the end cell they
+    # continue (never more new cells than the axis already has), existing cells are left as they are
+    if len(values) == 0:
+        return edges
+    low, high = float(np.min(values)), float(np.max(values))
+    num_cells = len(edges) - 1
+
+    if low < edges[0]:
+        gap, width = edges[0] - low, edges[1] - edges[0]
+        n = min(max(math.ceil(gap / width), 1), num_cells) if width > 0 else 1
+        below = edges[0] - gap * np.arange(n, 0, -1) / n
+        below[0] = low
+        edges = np.concatenate((below, edges))
+    if high > edges[-1]:
+        gap, width = high - edges[-1], edges[-1] - edges[-2]
+        n = min(max(math.ceil(gap / width), 1), num_cells) if width > 0 else 1
+        above = edges[-1] + gap * np.arange(1, n + 1) / n
+        above[-1] = high
+        edges = np.concatenate((edges, above))
+    return edges
+
+
+def get_partition_by_edges(values, edges):
+    # bucket i holds edges[i] <= value < edges[i + 1], the maximum goes to the last bucket
+    return np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+
+
+def spread_bits(values):
+    # put two zero bits between the low 21 bits of every value, ...b2 b1 b0 -> ...b2 0 0 b1 0 0 b0
+    values = np.asarray(values, dtype=np.uint64) & np.uint64(0x1FFFFF)
+    for shift, mask in ((32, 0x1F00000000FFFF), (16, 0x1F0000FF0000FF), (8, 0x100F00F00F00F00F),
+                        (4, 0x10C30C30C30C30C3), (2, 0x1249249249249249)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def morton_key(x, y, t):
+    # Z-order curve index of a cell, the bits of x, y and t interleaved (up to 2^21 cells per axis)
+    return spread_bits(x) << np.uint64(2) | spread_bits(y) << np.uint64(1) | spread_bits(t)
+
+
+def group_by_cell(lon_partition, lat_partition, time_partition, shape=(GRID_SIZE, GRID_SIZE, GRID_SIZE),
+                  layout='linear'):
+    # one linear id per record, sorted (x, y, t) order is the same as sorted id order
+    _, num_y, num_t = shape
+    cell_id = (lon_partition.astype(np.int64) * num_y + lat_partition) * num_t + time_partition
+    if layout == 'morton':
+        sort_key = morton_key(lon_partition, lat_partition, time_partition)
+    elif layout == 'linear':
+        sort_key = cell_id
+    else:
+        raise ValueError(f"unknown layout {layout!r}")
+
+    # stable, so records keep their input order inside a cell
+    order = np.argsort(sort_key, kind='stable')
+    _, offsets, counts = np.unique(sort_key[order], return_index=True, return_counts=True)
+
+    ids = cell_id[order][offsets]
+    cells = np.stack((ids // (num_y * num_t), ids // num_t % num_y, ids % num_t), axis=1)
+    return order, cells, offsets, counts
+
+
+def assign_cells(lon, lat, timestamps, bounds, shape=(GRID_SIZE, GRID_SIZE, GRID_SIZE), partitioning='uniform'):
+    # bucket of every record on each axis; quantile partitioning also returns the bucket boundaries
+    # (and may merge buckets), uniform partitioning is fully described by bounds and shape
+    min_lon, max_lon, min_lat, max_lat, min_time, max_time = bounds
+    if partitioning == 'quantile':
+        edges = (quantile_edges(lon, shape[0]), quantile_edges(lat, shape[1]), quantile_edges(timestamps, shape[2]))
+        partitions = tuple(get_partition_by_edges(values, axis_edges)
+                           for values, axis_edges in zip((lon, lat, timestamps), edges))
+        return partitions, edges, tuple(len(axis_edges) - 1 for axis_edges in edges)
+    if partitioning != 'uniform':
+        raise ValueError(f"unknown partitioning {partitioning!r}")
+
+    partitions = (get_partition(lon, min_lon, max_lon, shape[0]),
+                  get_partition(lat, min_lat, max_lat, shape[1]),
+                  get_partition(timestamps, min_time, max_time, shape[2]))
+    return partitions, None, tuple(shape)
+
+
+def build_grid_file(filename, lon, lat, timestamps, amount, bounds, partitions, shape, edges=None, prefix_cube=True,
+                    layout='linear', sample_size=0, histogram_bins=0):
+    # group the records by cell, keeping their original order inside a cell
+    order, cells, offsets, counts = group_by_cell(*partitions, shape, layout)
+
+    columns = {
+        'lon': np.asarray(lon, dtype=np.float64)[order],
+        'lat': np.asarray(lat, dtype=np.float64)[order],
+        'time': np.asarray(timestamps).astype(np.int64)[order],
+        'amount': np.asarray(amount, dtype=np.float64)[order],
+    }
+
+    # sum / min / max of Total_Amt per cell, fully inside cells are aggregated without their records
+    extra_sections = cell_aggregates(columns['amount'], offsets)
+
+    # cumulative count cube, lets Task2 count any box of cells with 8 lookups
+    if prefix_cube:
+        extra_sections['prefix_count'] = prefix_count_cube(cells, counts, shape)
+
+    # random sample of up to sample_size records per cell for the sampled approximate query
+    if sample_size > 0:
+        extra_sections.update(cell_samples(columns, offsets, counts, sample_size))
+
+    # histogram of every cell along each axis, the approximate query reads the share of a cell in the box from it
+    if histogram_bins > 0:
+        axis_edges = edges if edges is not None else uniform_edges(bounds, shape)
+        extra_sections.update(cell_histograms(columns, cells, counts, axis_edges, histogram_bins))
+
+    write_grid_file(filename, bounds, cells, offsets, counts, columns, extra_sections, edges, shape, layout)
+
+
+def cell_aggregates(amount, offsets):
+    # per-cell sum / min / max of Total_Amt, amount is grouped by cell and offsets start every cell
+    if len(offsets) == 0:
+        return {name: np.empty(0) for name in ('amount_sum', 'amount_min', 'amount_max')}
+    return {
+        'amount_sum': np.add.reduceat(amount, offsets),
+        'amount_min': np.minimum.reduceat(amount, offsets),
+        'amount_max': np.maximum.reduceat(amount, offsets),
+    }
+
+
+def cell_samples(columns, offsets, counts, sample_size, seed=0):
+    # uniform sample without replacement inside every cell: each record gets a random key and a cell
+    # keeps the records with the sample_size smallest keys, the same result as a reservoir of that size
+    rng = np.random.default_rng(seed)
+    cell_of_record = np.repeat(np.arange(len(counts)), counts)
+    order = np.lexsort((rng.random(len(cell_of_record)), cell_of_record))
+    rank = np.arange(len(order)) - np.repeat(offsets, counts)
+    chosen = np.sort(order[rank < sample_size])  # keep the record order of the cell
+
+    sample_counts = np.minimum(counts, sample_size)
+    return {
+        'sample_size': np.array([sample_size], dtype=np.int64),
+        'sample_offsets': np.concatenate(([0], np.cumsum(sample_counts)[:-1])).astype(np.int64),
+        'sample_counts': sample_counts.astype(np.int64),
+        'sample_lon': columns['lon'][chosen],
+        'sample_lat': columns['lat'][chosen],
+        'sample_time': columns['time'][chosen],
+    }
+
+
+def cell_histograms(columns, cells, counts, edges, bins):
+    # per cell and axis, records in each of `bins` equal slices of the cell's extent on that axis
+    cell_of_record = np.repeat(np.arange(len(counts)), counts)
+    histograms = {}
+    for axis, name in enumerate(('lon', 'lat', 'time')):
+        low = edges[axis][cells[:, axis]][cell_of_record]
+        high = edges[axis][cells[:, axis] + 1][cell_of_record]
+        position = (columns[name] - low) / np.where(high > low, high - low, 1)
+        bin_of_record = np.clip((position * bins).astype(np.int64), 0, bins - 1)
+        histograms['hist_' + name] = np.bincount(cell_of_record * bins + bin_of_record,
+                                                 minlength=len(counts) * bins).reshape(-1, bins).astype(np.int32)
+    return histograms
+
+
+def write_grid_file(filename, bounds, cells, offsets, counts, columns, extra_sections=None, edges=None, shape=None,
+                    layout='linear'):
+    if shape is None:
+        shape = tuple(len(axis_edges) - 1 for axis_edges in edges) if edges is not None else (GRID_SIZE,) * 3
+
+    # everything that goes into the file, in order
+    sections = [('cells', np.ascontiguousarray(cells, dtype='<i4')),
+                ('offsets', np.ascontiguousarray(offsets, dtype='<i8')),
+                ('counts', np.ascontiguousarray(counts, dtype='<i8'))]
+    for name in COLUMNS:
+        sections.append((name, np.ascontiguousarray(columns[name], dtype=COLUMN_DTYPES[name])))
+
+    # optional precomputed structures, e.g. the prefix count cube
+    for name, arr in (extra_sections or {}).items():
+        arr = np.asarray(arr)
+        sections.append((name, np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('<'))))
+
+    # the header size depends on the offsets it stores, so lay out until it stops changing
+    header = {}
+    header_bytes = b''
+    while True:
+        header_len = len(header_bytes)
+        pos = _align(len(MAGIC) + 4 + header_len)
+        table = {}
+        for name, arr in sections:
+            table[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': pos}
+            pos = _align(pos + arr.nbytes)
+        header = {
+            'version': VERSION,
+            'bounds': [float(b) for b in bounds],
+            'shape': [int(n) for n in shape],  # number of cells along lon, lat, time
+            'num_cells': int(len(counts)),
+            'num_records': int(len(columns['lon'])),
+            'sections': table,
+        }
+        if edges is not None:
+            # non-uniform partitioning, the bucket boundaries of every axis
+            header['edges'] = [[float(e) for e in axis_edges] for axis_edges in edges]
+        if layout != 'linear':
+            header['layout'] = layout
+        header_bytes = json.dumps(header).encode('utf-8')
+        if len(header_bytes) == header_len:
+            break
+
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint32(len(header_bytes)).astype('<u4').tobytes())
+        f.write(header_bytes)
+        for name, arr in sections:
+            f.seek(header['sections'][name]['offset'])
+            arr.tofile(f)
+
+
+def read_grid_header(filename):
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a binary grid file")
+        header_len = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    if header['version'] > VERSION:
+        raise ValueError(f"unsupported grid file version {header['version']}")
+    return header
+
+
+def load_grid_file(filename):
+    header = read_grid_header(filename)
+
+    # map every section read-only, nothing is read until it is touched
+    grid = {'bounds': tuple(header['bounds']), 'shape': tuple(header.get('shape', (GRID_SIZE,) * 3)),
+            'layout': header.get('layout', 'linear')}
+    if 'edges' in header:
+        grid['edges'] = tuple(np.array(axis_edges, dtype=np.float64) for axis_edges in header['edges'])
+    for name, info in header['sections'].items():
+        shape = tuple(info['shape'])
+        if 0 in shape:
+            grid[name] = np.empty(shape, dtype=info['dtype'])  # mmap cannot map 0 bytes
+        else:
+            grid[name] = np.memmap(filename, dtype=info['dtype'], mode='r', offset=info['offset'], shape=shape)
+
+    index_grid(grid)
+    return grid
+
+
+def delta_file_names(filename):
+    # grid.bin.delta1, grid.bin.delta2, ... written by append_grid.py, in append order
+    prefix = filename + '.delta'
+    names = [name for name in glob.glob(glob.escape(prefix) + '*') if name[len(prefix):].isdigit()]
+    return sorted(names, key=lambda name: int(name[len(prefix):]))
+
+
+def grid_part_files(filename):
+    return [filename] + delta_file_names(filename)
+
+
+def load_grid_parts(filename):
+    # the base grid and every appended batch, a query is answered on each part and the answers added up
+    return [load_grid_file(name) for name in grid_part_files(filename)]
+
+
+def cell_edges(min_value, max_value, grid_size=GRID_SIZE):
+    # cell i covers [edges[i], edges[i + 1]], same arithmetic as the per-cell bounds in get_cell_status
+    return min_value + (np.arange(grid_size + 1) / grid_size) * (max_value - min_value)
+
+
+def uniform_edges(bounds, shape):
+    min_lon, max_lon, min_lat, max_lat, min_time, max_time = bounds
+    num_x, num_y, num_t = shape
+    return (cell_edges(min_lon, max_lon, num_x), cell_edges(min_lat, max_lat, num_y),
+            cell_edges(min_time, max_time, num_t))
+
+
+def index_grid(grid):
+    # uniform grids only store their bounds and shape
+    if 'edges' not in grid:
+        grid['edges'] = uniform_edges(grid['bounds'], grid['shape'])
+    grid['shape'] = tuple(len(edges) - 1 for edges in grid['edges'])
+
+    # dense count per cell and the first record of every cell id (0 for empty cells),
+    # so any cell is found without searching the directory, whatever the layout of the file
+    cells = np.asarray(grid['cells'], dtype=np.int64)
+    counts = np.asarray(grid['counts'], dtype=np.int64)
+    cell_count = np.zeros(grid['shape'], dtype=np.int64)
+    cell_count[cells[:, 0], cells[:, 1], cells[:, 2]] = counts
+    grid['cell_count'] = cell_count
+    cell_start = np.zeros(grid['shape'], dtype=np.int64)
+    cell_start[cells[:, 0], cells[:, 1], cells[:, 2]] = grid['offsets']
+    grid['cell_start'] = cell_start.ravel()
+
+    # directory row of every cell id, for the per-cell histograms
+    if 'hist_lon' in grid:
+        cell_row = np.zeros(grid['shape'], dtype=np.int64)
+        cell_row[cells[:, 0], cells[:, 1], cells[:, 2]] = np.arange(len(cells))
+        grid['cell_row'] = cell_row.ravel()
+
+    # first sample record and sample size of every cell id, like cell_start / cell_count
+    if 'sample_offsets' in grid:
+        sample_start = np.zeros(grid['shape'], dtype=np.int64)
+        sample_start[cells[:, 0], cells[:, 1], cells[:, 2]] = grid['sample_offsets']
+        sample_count = np.zeros(grid['shape'], dtype=np.int64)
+        sample_count[cells[:, 0], cells[:, 1], cells[:, 2]] = grid['sample_counts']
+        grid['cell_sample_start'] = sample_start.ravel()
+        grid['cell_sample_count'] = sample_count.ravel()
+
+    # dense per-cell Total_Amt aggregates, empty cells are neutral for sum / min / max
+    if 'amount_sum' in grid:
+        for name, empty in (('amount_sum', 0.0), ('amount_min', np.inf), ('amount_max', -np.inf)):
+            dense = np.full(grid['shape'], empty)
+            dense[cells[:, 0], cells[:, 1], cells[:, 2]] = grid[name]
+            grid['cell_' + name] = dense
+
+
+def prefix_count_cube(cells, counts, shape):
+    # P[i, j, k] = number of records in cells with x < i, y < j, t < k
+    cube = np.zeros(tuple(n + 1 for n in shape), dtype=np.int64)
+    cube[cells[:, 0] + 1, cells[:, 1] + 1, cells[:, 2] + 1] = counts
+    for axis in range(3):
+        np.cumsum(cube, axis=axis, out=cube)
+    return cube
+
+
+def box_count(cube, x0, x1, y0, y1, t0, t1):
+    # records in the cells [x0, x1] x [y0, y1] x [t0, t1], 8 lookups
+    if x0 > x1 or y0 > y1 or t0 > t1:
+        return 0
+    x1, y1, t1 = x1 + 1, y1 + 1, t1 + 1
+    return int(cube[x1, y1, t1] - cube[x0, y1, t1] - cube[x1, y0, t1] - cube[x1, y1, t0]
+               + cube[x0, y0, t1] + cube[x0, y1, t0] + cube[x1, y0, t0] - cube[x0, y0, t0])
+
+
+def axis_overlap(edges, low, up):
+    # cells [first, last] of one axis that overlap [low, up], and the cells [inner_first, inner_last]
+    # that lie inside it. The three axes are independent: a cell is fully inside the query box when
+    # it is inside on every axis, and partially inside when it overlaps on every axis but is not fully inside.
+    num_cells = len(edges) - 1
+    below = int(np.searchsorted(edges, low, side='left'))  # edges < low
+    not_above = int(np.searchsorted(edges, up, side='right'))  # edges <= up
+
+    first = max(below - 1, 0)
+    last = min(not_above - 1, num_cells - 1)
+    return first, last, below, not_above - 2
+
+
+def get_cell_ranges(grid, low_x, up_x, low_y, up_y, low_time, up_time):
+    return (axis_overlap(grid['edges'][0], low_x, up_x),
+            axis_overlap(grid['edges'][1], low_y, up_y),
+            axis_overlap(grid['edges'][2], low_time, up_time))
+
+
+def axis_fraction(edges, first, last, low, up):
+    # overlap ratio of the query with each cell in [first, last] along one axis
+    cell_min = edges[first:last + 1]
+    cell_max = edges[first + 1:last + 2]
+    return np.maximum(0, np.minimum(cell_max, up) - np.maximum(cell_min, low)) / (cell_max - cell_min)
+
+
+def get_cell_ranges_batch(grid, boxes):
+    # get_cell_ranges for a (Q, 6) array of query boxes at once -> (Q, 3, 4) array,
+    # every query bound is searched in the cell edges of its axis in one call
+    ranges = np.empty((len(boxes), 3, 4), dtype=np.int64)
+    for axis, edges in enumerate(grid['edges']):
+        num_cells = len(edges) - 1
+        below = np.searchsorted(edges, boxes[:, 2 * axis], side='left')
+        not_above = np.searchsorted(edges, boxes[:, 2 * axis + 1], side='right')
+        ranges[:, axis, 0] = np.maximum(below - 1, 0)
+        ranges[:, axis, 1] = np.minimum(not_above - 1, num_cells - 1)
+        ranges[:, axis, 2] = below
+        ranges[:, axis, 3] = not_above - 2
+    return ranges
+
+
+def get_cell_status(grid, low_x, up_x, low_y, up_y, low_time, up_time):
+    # block of cells the query box overlaps and which cells of the block are fully inside it,
+    # the rest of the block (its boundary layer) is partially inside. (None, None) if nothing overlaps
+    ranges = get_cell_ranges(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if any(first > last for first, last, _, _ in ranges):
+        return None, None
+
+    block = tuple(slice(first, last + 1) for first, last, _, _ in ranges)
+    inside = []
+    for first, last, inner_first, inner_last in ranges:
+        cells = np.arange(first, last + 1)
+        inside.append((inner_first <= cells) & (cells <= inner_last))
+    x_inside, y_inside, t_inside = inside
+    fully_inside = x_inside[:, None, None] & y_inside[None, :, None] & t_inside[None, None, :]
+    return block, fully_inside
+
+
+def shell_boxes(ranges):
+    # the overlapping block minus its fully inside box, as at most 6 disjoint boxes of cells
+    (x0, x1, xi0, xi1), (y0, y1, yi0, yi1), (t0, t1, ti0, ti1) = ranges
+    if xi0 > xi1 or yi0 > yi1 or ti0 > ti1:
+        return [(x0, x1, y0, y1, t0, t1)]
+    boxes = [(x0, xi0 - 1, y0, y1, t0, t1), (xi1 + 1, x1, y0, y1, t0, t1),
+             (xi0, xi1, y0, yi0 - 1, t0, t1), (xi0, xi1, yi1 + 1, y1, t0, t1),
+             (xi0, xi1, yi0, yi1, t0, ti0 - 1), (xi0, xi1, yi0, yi1, ti1 + 1, t1)]
+    return [box for box in boxes if box[0] <= box[1] and box[2] <= box[3] and box[4] <= box[5]]
+
+
+def axis_segments(edges, first, last, low, up):
+    # [first, last] split into runs of equal overlap ratio: only the two end cells can be cut by the query
+    if first == last:
+        return [(first, last, float(axis_fraction(edges, first, last, low, up)[0]))]
+    segments = [(first, first, float(axis_fraction(edges, first, first, low, up)[0]))]
+    if first + 1 <= last - 1:
+        segments.append((first + 1, last - 1, 1.0))
+    segments.append((last, last, float(axis_fraction(edges, last, last, low, up)[0])))
+    return segments
+
+
+def approximate_box_count(grid, low_x, up_x, low_y, up_y, low_time, up_time):
+    # sum of f * count over the overlapping block with the prefix cube: the ratio f is constant
+    # on each of the (at most) 3 x 3 x 3 sub-boxes, so every sub-box is one box_count
+    ranges = get_cell_ranges(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if any(first > last for first, last, _, _ in ranges):
+        return 0.0
+    bounds = ((low_x, up_x), (low_y, up_y), (low_time, up_time))
+    x_seg, y_seg, t_seg = (axis_segments(edges, first, last, low, up)
+                           for edges, (first, last, _, _), (low, up) in zip(grid['edges'], ranges, bounds))
+    total = 0.0
+    for x0, x1, fx in x_seg:
+        for y0, y1, fy in y_seg:
+            for t0, t1, ft in t_seg:
+                f = fx * fy * ft
+                if f > 0:
+                    total += f * box_count(grid['prefix_count'], x0, x1, y0, y1, t0, t1)
+    return total
+
+
+def cell_fractions(grid, ranges, bounds, ids):
+    # overlap ratio f of the given cells (linear ids inside the overlapping block of ranges)
+    _, num_y, num_t = grid['shape']
+    f = np.ones(len(ids))
+    for coord, edges, (first, last, _, _), (low, up) in zip((ids // (num_y * num_t), ids // num_t % num_y, ids % num_t),
+                                                             grid['edges'], ranges, bounds):
+        f *= axis_fraction(edges, first, last, low, up)[coord - first]
+    return f
+
+
+def bounded_box_count(grid, low_x, up_x, low_y, up_y, low_time, up_time, target_error=0.05):
+    # estimate and guaranteed interval [lower, upper] of the count: fully inside cells are exact and a
+    # partially inside cell holds between 0 and count matching records, f * count expected.
+    # Partial cells with the widest intervals (the most records) are scanned exactly until
+    # max(estimate - lower, upper - estimate) <= target_error * estimate, target_error=0 is an exact count
+    ranges = get_cell_ranges(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if any(first > last for first, last, _, _ in ranges):
+        return 0.0, 0, 0
+    lower = inside_count(grid, ranges)
+
+    ids = shell_cell_ids(grid, ranges)
+    counts = grid['cell_count'].ravel()[ids]
+    order = np.argsort(-counts, kind='stable')
+    ids, counts = ids[order], counts[order]
+    expected = cell_fractions(grid, ranges, ((low_x, up_x), (low_y, up_y), (low_time, up_time)), ids) * counts
+
+    # with the first k cells scanned, the others add below[k] to the estimate and the interval
+    # reaches below[k] under it and above[k] over it
+    below = np.append(np.cumsum(expected[::-1])[::-1], 0.0)
+    above = np.append(np.cumsum((counts - expected)[::-1])[::-1], 0.0)
+    spread = np.maximum(below, above)
+
+    scanned = 0
+    while True:
+        estimate = lower + below[scanned]
+        allowed = target_error * max(estimate, 1.0)
+        if spread[scanned] <= allowed:
+            break
+        # fewest further cells that meet the target if the estimate does not move
+        stop = scanned + max(int(np.argmax(spread[scanned:] <= allowed)), 1)
+        indices = record_indices(grid, ids[scanned:stop])
+        lower += int(np.count_nonzero(match_records(grid, indices, low_x, up_x, low_y, up_y, low_time, up_time)))
+        scanned = stop
+
+    return float(estimate), int(lower), int(lower + counts[scanned:].sum())
+
+
+def histogram_box_count(grid, low_x, up_x, low_y, up_y, low_time, up_time):
+    # like sampled_box_count, the share of a partially inside cell in the box comes from its per-axis
+    # histograms (records uniform inside a bin) instead of from the overlap ratio of the whole cell
+    ranges = get_cell_ranges(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if any(first > last for first, last, _, _ in ranges):
+        return 0.0
+    ids = shell_cell_ids(grid, ranges)
+    rows = grid['cell_row'][ids]
+    counts = grid['cell_count'].ravel()[ids]
+    _, num_y, num_t = grid['shape']
+
+    share = np.ones(len(ids))
+    for coord, edges, name, (low, up) in zip((ids // (num_y * num_t), ids // num_t % num_y, ids % num_t),
+                                             grid['edges'], ('hist_lon', 'hist_lat', 'hist_time'),
+                                             ((low_x, up_x), (low_y, up_y), (low_time, up_time))):
+        histogram = grid[name][rows]
+        bins = histogram.shape[1]
+        bin_edges = edges[coord][:, None] + (edges[coord + 1] - edges[coord])[:, None] * np.arange(bins + 1) / bins
+        width = bin_edges[:, 1:] - bin_edges[:, :-1]
+        overlap = np.minimum(bin_edges[:, 1:], up) - np.maximum(bin_edges[:, :-1], low)
+        ratio = np.clip(overlap / np.where(width > 0, width, 1), 0, 1)
+        share *= (histogram * ratio).sum(axis=1) / np.maximum(counts, 1)
+    return inside_count(grid, ranges) + float((share * counts).sum())
+
+
+def get_cell_status_and_fraction(grid, low_x, up_x, low_y, up_y, low_time, up_time):
+    # block of cells the query box overlaps and the overlap ratio f of every cell in it,
+    # f == 1 is fully inside, 0 < f < 1 partially inside
+    block, _ = get_cell_status(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if block is None:
+        return None, None
+
+    x, y, t = block
+    lon_overlap = axis_fraction(grid['edges'][0], x.start, x.stop - 1, low_x, up_x)
+    lat_overlap = axis_fraction(grid['edges'][1], y.start, y.stop - 1, low_y, up_y)
+    time_overlap = axis_fraction(grid['edges'][2], t.start, t.stop - 1, low_time, up_time)
+    f = lon_overlap[:, None, None] * lat_overlap[None, :, None] * time_overlap[None, None, :]
+    return block, f
+
+
+def inside_count(grid, ranges):
+    # records in the box of fully inside cells, 8 lookups when the prefix cube was built
+    (_, _, x0, x1), (_, _, y0, y1), (_, _, t0, t1) = ranges
+    if 'prefix_count' in grid:
+        return box_count(grid['prefix_count'], x0, x1, y0, y1, t0, t1)
+    if x0 > x1 or y0 > y1 or t0 > t1:
+        return 0
+    return int(grid['cell_count'][x0:x1 + 1, y0:y1 + 1, t0:t1 + 1].sum())
+
+
+def inside_count_batch(grid, ranges):
+    # inside_count for a (Q, 3, 4) array of cell ranges
+    if 'prefix_count' not in grid:
+        return np.array([inside_count(grid, r) for r in ranges.tolist()], dtype=np.int64)
+
+    cube = grid['prefix_count']
+    x0, x1, y0, y1, t0, t1 = (ranges[:, axis, i] for axis in range(3) for i in (2, 3))
+    # empty boxes look up the all-zero corner
+    empty = (x0 > x1) | (y0 > y1) | (t0 > t1)
+    x0, y0, t0 = (np.where(empty, 0, v) for v in (x0, y0, t0))
+    x1, y1, t1 = (np.where(empty, 0, v + 1) for v in (x1, y1, t1))
+    return (cube[x1, y1, t1] - cube[x0, y1, t1] - cube[x1, y0, t1] - cube[x1, y1, t0]
+            + cube[x0, y0, t1] + cube[x0, y1, t0] + cube[x1, y0, t0] - cube[x0, y0, t0])
+
+
+def shell_cell_ids(grid, ranges):
+    # non-empty partially inside cells, without visiting the fully inside box
+    ids = [box_cell_ids(grid, box) for box in shell_boxes(ranges)]
+    return np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+
+
+def shell_sides(grid, ranges, ids):
+    # for every axis, which of the given cells stick out of the query below its fully inside range and which above
+    _, num_y, num_t = grid['shape']
+    cell = (ids // (num_y * num_t), ids // num_t % num_y, ids % num_t)
+    return [(index < inner_first, index > inner_last)
+            for index, (_, _, inner_first, inner_last) in zip(cell, ranges)]
+
+
+def shell_groups(outside):
+    # partially inside cells split by the axes they stick out of: the face cells of one axis compare only that
+    # column, edge and corner cells (name None) every column
+    num_outside = outside[0].astype(np.int64) + outside[1] + outside[2]
+    groups = [(name, axis_outside & (num_outside == 1)) for name, axis_outside in zip(('lon', 'lat', 'time'), outside)]
+    return groups + [(None, num_outside > 1)]
+
+
+def shell_match_count(grid, ranges, low_x, up_x, low_y, up_y, low_time, up_time, ids=None):
+    # matching records of the partially inside cells (ids, when the caller has them already). A cell within the
+    # fully inside range of an axis keeps all its records along that axis, so only the axes a cell sticks out of
+    # are compared: the face cells of a box (most of its shell) read and compare a single column instead of three
+    if ids is None:
+        ids = shell_cell_ids(grid, ranges)
+    if len(ids) == 0:
+        return 0
+    if any(inner_first > inner_last for _, _, inner_first, inner_last in ranges):
+        # no fully inside box (small queries), every cell sticks out of the box along that axis anyway
+        return int(np.count_nonzero(match_records(grid, record_indices(grid, ids),
+                                                  low_x, up_x, low_y, up_y, low_time, up_time)))
+    outside = [below | above for below, above in shell_sides(grid, ranges, ids)]
+    bounds = {'lon': (low_x, up_x), 'lat': (low_y, up_y), 'time': (low_time, up_time)}
+
+    total = 0
+    for name, group in shell_groups(outside):
+        if not group.any():
+            continue
+        indices = record_indices(grid, ids[group])
+        if name is None:
+            total += np.count_nonzero(match_records(grid, indices, low_x, up_x, low_y, up_y, low_time, up_time))
+        else:
+            values = grid[name][indices]
+            total += np.count_nonzero((bounds[name][0] <= values) & (values <= bounds[name][1]))
+    return int(total)
+
+
+def shell_cell_counts(grid, ids, outside, low_x, up_x, low_y, up_y, low_time, up_time):
+    # shell_match_count for each of the given partially inside cells, outside as in shell_groups.
+    # Every cell is in exactly one group
+    counts = np.zeros(len(ids), dtype=np.int64)
+    bounds = {'lon': (low_x, up_x), 'lat': (low_y, up_y), 'time': (low_time, up_time)}
+    for name, group in shell_groups(outside):
+        positions = np.flatnonzero(group)
+        if len(positions) == 0:
+            continue
+        starts = grid['cell_start'][ids[positions]]
+        lengths = grid['cell_count'].ravel()[ids[positions]]
+        order = np.argsort(starts, kind='stable')
+        indices = range_indices(starts[order], lengths[order])
+        if name is None:
+            match = match_records(grid, indices, low_x, up_x, low_y, up_y, low_time, up_time)
+        else:
+            values = grid[name][indices]
+            match = (bounds[name][0] <= values) & (values <= bounds[name][1])
+        # the cells are non-empty, every one has a segment of the mask
+        counts[positions[order]] = np.add.reduceat(match, np.cumsum(lengths[order]) - lengths[order], dtype=np.int64)
+    return counts
+
+
+def box_cell_ids(grid, box):
+    # linear ids of the non-empty cells in [x0, x1] x [y0, y1] x [t0, t1]
+    x0, x1, y0, y1, t0, t1 = box
+    block = (slice(x0, x1 + 1), slice(y0, y1 + 1), slice(t0, t1 + 1))
+    return block_cell_ids(grid, block, grid['cell_count'][block] > 0)
+
+
+def block_cell_ids(grid, block, mask):
+    # linear ids of the cells selected by mask inside block, in sorted (x, y, t) order
+    x, y, t = np.nonzero(mask)
+    _, num_y, num_t = grid['shape']
+    return ((x + block[0].start) * num_y + y + block[1].start) * num_t + t + block[2].start
+
+
+def record_indices(grid, ids):
+    # positions of all records of the given cells, in file order, so the columns are read front to back
+    # (for a linear grid and sorted ids that is also cell order)
+    starts = grid['cell_start'][ids]
+    lengths = grid['cell_count'].ravel()[ids]
+    order = np.argsort(starts, kind='stable')
+    return range_indices(starts[order], lengths[order])
+
+
+def range_indices(starts, lengths):
+    # starts[i], ..., starts[i] + lengths[i] - 1 for every i, concatenated
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    shift = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return shift + np.arange(total)
+
+
+def sampled_box_count(grid, low_x, up_x, low_y, up_y, low_time, up_time):
+    # fully inside cells are counted exactly, a partially inside cell adds count * (share of its sample
+    # that meets the query), cells smaller than the sample are therefore exact as well
+    ranges = get_cell_ranges(grid, low_x, up_x, low_y, up_y, low_time, up_time)
+    if any(first > last for first, last, _, _ in ranges):
+        return 0.0
+    ids = shell_cell_ids(grid, ranges)
+    sample_count = grid['cell_sample_count'][ids]
+    indices = range_indices(grid['cell_sample_start'][ids], sample_count)
+    labels = np.repeat(np.arange(len(ids)), sample_count)
+
+    lon, lat, timestamp = grid['sample_lon'][indices], grid['sample_lat'][indices], grid['sample_time'][indices]
+    match = ((low_x <= lon) & (lon <= up_x) &
+             (low_y <= lat) & (lat <= up_y) &
+             (low_time <= timestamp) & (timestamp <= up_time))
+    hits = np.bincount(labels[match], minlength=len(ids))
+    share = hits / np.maximum(sample_count, 1)
+    return inside_count(grid, ranges) + float((share * grid['cell_count'].ravel()[ids]).sum())
+
+
+def amount_aggregate(count, total, low, high):
+    # SUM / AVG / MIN / MAX of Total_Amt, AVG / MIN / MAX are None when nothing matches
+    if count == 0:
+        return {'count': 0, 'sum': 0.0, 'avg': None, 'min': None, 'max': None}
+    return {'count': count, 'sum': float(total), 'avg': float(total) / count, 'min': float(low), 'max': float(high)}
+
+
+def match_records(grid, indices, low_x, up_x, low_y, up_y, low_time, up_time):
+    # mask of the given records that meet the query criteria
+    lon, lat, timestamp = grid['lon'][indices], grid['lat'][indices], grid['time'][indices]
+    return ((low_x <= lon) & (lon <= up_x) &
+            (low_y <= lat) & (lat <= up_y) &
+            (low_time <= timestamp) & (timestamp <= up_time))
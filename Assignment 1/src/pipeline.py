@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from grid_file import assign_cells, build_grid_file, epoch_seconds
+
+# One pass from the raw parquet to grid.bin: subset_select.py + Task1.py without subset.parquet and
+# data_select.parquet in between. Batches are filtered like subset_select.py (lon / lat in range, pickup
+# inside [start_date, end_date]) and only the four numeric columns are kept, min / max are tracked batch
+# by batch. Cells are assigned once every batch is in, grouping by cell needs all the records anyway,
+# so bounds never have to be known up front.
+# outliers.csv is not written here, run subset_select.py for the outlier report.
+
+raw_file = '../Datasets/yellow_tripdata_2009-02.parquet'
+grid_path = '../Datasets/grid.bin'
+columns = ['Trip_Pickup_DateTime', 'Start_Lon', 'Start_Lat', 'Total_Amt']
+batch_size = 1_000_000
+start_date = '2009-02-01'
+end_date = '2009-03-01'
+
+
+def clean_batches(file_path, batch_size=batch_size):
+    # lon, lat, int64 epoch seconds and amount of the valid rows of every batch, and the lon / lat outlier count
+    for batch in pq.ParquetFile(file_path).iter_batches(batch_size=batch_size, columns=columns):
+        df = batch.to_pandas()
+        pickup = pd.to_datetime(df['Trip_Pickup_DateTime'], errors='coerce')
+        valid = (df['Start_Lon'].between(-180, 180) & df['Start_Lat'].between(-90, 90)).to_numpy()
+        outliers = int((~valid).sum())
+        valid = valid & pickup.notna().to_numpy() & ~((pickup < start_date) | (pickup > end_date)).to_numpy()
+        timestamps = epoch_seconds(pickup[valid])
+        yield (df['Start_Lon'].to_numpy(dtype=np.float64)[valid], df['Start_Lat'].to_numpy(dtype=np.float64)[valid],
+               timestamps, df['Total_Amt'].to_numpy(dtype=np.float64)[valid]), outliers
+
+
+def run_pipeline(file_path, grid_path, shape=(100, 100, 100), partitioning='uniform', layout='linear',
+                 sample_size=32, histogram_bins=0):
+    parts = ([], [], [], [])
+    low = np.full(3, np.inf)
+    high = np.full(3, -np.inf)
+    outlier_rows = 0
+
+    for arrays, outliers in clean_batches(file_path):
+        for part, values in zip(parts, arrays):
+            part.append(values)
+        if len(arrays[0]):
+            low = np.minimum(low, [values.min() for values in arrays[:3]])
+            high = np.maximum(high, [values.max() for values in arrays[:3]])
+        outlier_rows += outliers
+
+    lon, lat, timestamps, amount = (np.concatenate(part) if part else np.empty(0) for part in parts)
+    bounds = (low[0], high[0], low[1], high[1], low[2], high[2])
+
+    partitions, edges, shape = assign_cells(lon, lat, timestamps, bounds, shape, partitioning)
+    build_grid_file(grid_path, lon, lat, timestamps, amount, bounds, partitions, shape, edges, prefix_cube=True,
+                    layout=layout, sample_size=sample_size, histogram_bins=histogram_bins)
+    return len(lon), outlier_rows, bounds
+
+
+if __name__ == "__main__":
+    start_time = time.time()
+    num_records, outlier_rows, bounds = run_pipeline(raw_file, grid_path)
+    print(f"Lon and Lat outliers rows: {outlier_rows}")
+    print(*bounds)
+    print(f"Wrote {num_records} records to '{grid_path}' in {time.time() - start_time:.2f} seconds")
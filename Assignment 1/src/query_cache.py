@@ -0,0 +1,161 @@
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from grid_file import get_cell_ranges, inside_count, shell_cell_counts, shell_cell_ids, shell_match_count, shell_sides
+
+# Result cache for exact counts on one grid part (grid.bin or one delta, the files never change).
+#
+# Two levels, each with its own memory cap, so cell entries never evict a box:
+#   boxes   count of a whole query, keyed on the box clipped to the bounds of the grid, an OrderedDict LRU
+#   cells   matching records of one partially inside cell for one clipped predicate. The predicate is the
+#           query box with -inf / inf on every side the cell does not stick out of, so overlapping queries with
+#           the same boundary cell and the same clipped predicate reuse the count without reading the records.
+#           The cells sit in numpy slots (cell id -> slot), one predicate per cell, looked up for all boundary
+#           cells of a query at once; when the slots run out the least recently used quarter is evicted.
+#           A query with fewer than MIN_CELLS boundary cells skips this level, scanning them costs less than
+#           the lookups. The level also only pays when boundary cells come back with the same predicate: while
+#           the queries through it found less than MIN_HIT_RATE of their boundary records in the slots, only two
+#           queries in a row of every PROBE_EVERY take it (the second one finds the cells of the first when
+#           consecutive queries overlap), the others are scanned like exact_counts_batch does
+
+ENTRY_OVERHEAD = 100  # bytes of one OrderedDict entry, on top of the key and the value
+# a box entry: tuple of 6 floats -> int count (an int of up to 62 bits)
+BOX_ENTRY_BYTES = ENTRY_OVERHEAD + sys.getsizeof((0.0,) * 6) + 6 * sys.getsizeof(0.0) + sys.getsizeof(2 ** 62)
+SLOT_BYTES = 8 * 6 + 8 + 8 + 8  # predicate, count, cell id and last use of one cell slot
+MIN_CELLS = 64
+MIN_HIT_RATE = 0.25
+PROBE_EVERY = 16
+
+
+class QueryCache:
+    def __init__(self, grid, max_bytes=56 * 2 ** 20, box_bytes=8 * 2 ** 20):
+        # plain ndarray views of the mapped sections, every index into a np.memmap goes through its Python
+        # __getitem__, which costs more than the scan of a small query
+        self.grid = {name: np.asarray(value) if isinstance(value, np.memmap) else value for name, value in grid.items()}
+        self.box_bytes = box_bytes
+        self.boxes = OrderedDict()
+        self.stats = {'box_hits': 0, 'box_misses': 0, 'cell_hits': 0, 'cell_misses': 0, 'cell_bypasses': 0,
+                      'box_evictions': 0, 'cell_evictions': 0}
+
+        # boxes are clipped to the data, every box covering the whole grid on an axis is the same key
+        edges = grid['edges']
+        self.bounds = tuple((float(axis_edges[0]), float(axis_edges[-1])) for axis_edges in edges)
+
+        # cell level, max_bytes covers the cell id -> slot map and the slots
+        num_cells = grid['cell_count'].size
+        self.slot_of = np.full(num_cells, -1, dtype=np.int32)
+        capacity = int(min(num_cells, max(0, max_bytes - self.slot_of.nbytes) // SLOT_BYTES))
+        self.slot_predicate = np.empty((capacity, 6), dtype=np.float64)
+        self.slot_count = np.empty(capacity, dtype=np.int64)
+        self.slot_cell = np.full(capacity, -1, dtype=np.int64)
+        self.slot_used = np.zeros(capacity, dtype=np.int64)
+        self.free = np.arange(capacity, dtype=np.int64)
+        self.clock = 0  # query number, the last use of a slot
+        self.hit_rate = 0.0  # share of the boundary records found in the slots, decayed over the queries
+        self.queries = PROBE_EVERY - 3  # queries with MIN_CELLS boundary cells or more, the first two probe
+
+    def get_box(self, box):
+        total = self.boxes.get(box)
+        if total is not None:
+            self.boxes.move_to_end(box)
+        return total
+
+    def put_box(self, box, total):
+        self.boxes[box] = total
+        while len(self.boxes) * BOX_ENTRY_BYTES > self.box_bytes and self.boxes:
+            self.boxes.popitem(last=False)
+            self.stats['box_evictions'] += 1
+
+    def normalize(self, low_x, up_x, low_y, up_y, low_time, up_time):
+        (min_x, max_x), (min_y, max_y), (min_time, max_time) = self.bounds
+        return (max(float(low_x), min_x), min(float(up_x), max_x), max(float(low_y), min_y), min(float(up_y), max_y),
+                max(float(low_time), min_time), min(float(up_time), max_time))
+
+    def count(self, low_x, up_x, low_y, up_y, low_time, up_time):
+        box = self.normalize(low_x, up_x, low_y, up_y, low_time, up_time)
+        total = self.get_box(box)
+        if total is not None:
+            self.stats['box_hits'] += 1
+            return total
+        self.stats['box_misses'] += 1
+
+        total = 0
+        ranges = get_cell_ranges(self.grid, *box)
+        if all(first <= last for first, last, _, _ in ranges):
+            total = inside_count(self.grid, ranges) + self.partial_count(box, ranges)
+        self.put_box(box, total)
+        return total
+
+    def partial_count(self, box, ranges):
+        # matching records of the partially inside cells, the cached ones from their slots, the rest scanned
+        # like exact_counts_batch does and stored
+        ids = shell_cell_ids(self.grid, ranges)
+        if len(ids) == 0:
+            return 0
+        if len(ids) < MIN_CELLS:
+            return shell_match_count(self.grid, ranges, *box, ids=ids)
+        self.queries += 1
+        if self.hit_rate < MIN_HIT_RATE and self.queries % PROBE_EVERY < PROBE_EVERY - 2:
+            self.stats['cell_bypasses'] += 1
+            return shell_match_count(self.grid, ranges, *box, ids=ids)
+        self.clock += 1
+        sides = shell_sides(self.grid, ranges, ids)
+        predicate = np.empty((len(ids), 6), dtype=np.float64)
+        for axis, (below, above) in enumerate(sides):
+            predicate[:, 2 * axis] = np.where(below, box[2 * axis], -np.inf)
+            predicate[:, 2 * axis + 1] = np.where(above, box[2 * axis + 1], np.inf)
+
+        slots = self.slot_of[ids].astype(np.int64)
+        hit = slots >= 0
+        hit[hit] = np.all(self.slot_predicate[slots[hit]] == predicate[hit], axis=1)
+        hit_slots = slots[hit]
+        self.slot_used[hit_slots] = self.clock
+        total = int(self.slot_count[hit_slots].sum())
+        self.stats['cell_hits'] += len(hit_slots)
+        lengths = self.grid['cell_count'].ravel()[ids]
+        self.hit_rate = (self.hit_rate + lengths[hit].sum() / lengths.sum()) / 2
+
+        miss = ~hit
+        if miss.any():
+            self.stats['cell_misses'] += int(np.count_nonzero(miss))
+            outside = [(below | above)[miss] for below, above in sides]
+            counts = shell_cell_counts(self.grid, ids[miss], outside, *box)
+            total += int(counts.sum())
+            self.store(ids[miss], slots[miss], predicate[miss], counts)
+        return total
+
+    def store(self, ids, slots, predicate, counts):
+        # a cell already in a slot keeps it (with the new predicate), the others take free slots
+        new = slots < 0
+        self.slot_used[slots[~new]] = self.clock  # not evicted for the new ones
+        fresh = self.allocate(int(np.count_nonzero(new)))
+        positions = np.flatnonzero(new)[:len(fresh)]  # a query with more new cells than slots stores the first
+        slots[positions] = fresh
+        self.slot_of[ids[positions]] = fresh
+        self.slot_cell[fresh] = ids[positions]
+        kept = slots >= 0
+        self.slot_predicate[slots[kept]] = predicate[kept]
+        self.slot_count[slots[kept]] = counts[kept]
+        self.slot_used[slots[kept]] = self.clock
+
+    def allocate(self, n):
+        # up to n free slots, when they run out the least recently used quarter of the slots (not counting the
+        # ones of the current query) is evicted at once
+        if len(self.free) < n:
+            candidates = np.flatnonzero((self.slot_cell >= 0) & (self.slot_used < self.clock))
+            k = min(len(candidates), max(n - len(self.free), len(self.slot_cell) // 4))
+            if k > 0:
+                victims = candidates[np.argpartition(self.slot_used[candidates], k - 1)[:k]]
+                self.slot_of[self.slot_cell[victims]] = -1
+                self.slot_cell[victims] = -1
+                self.free = np.concatenate((self.free, victims))
+                self.stats['cell_evictions'] += k
+        slots, self.free = self.free[:n], self.free[n:]
+        return slots
+
+    def summary(self):
+        cells = len(self.slot_cell) - len(self.free)
+        return dict(self.stats, boxes=len(self.boxes), box_bytes=len(self.boxes) * BOX_ENTRY_BYTES, cells=cells,
+                    cell_bytes=self.slot_of.nbytes + cells * SLOT_BYTES)
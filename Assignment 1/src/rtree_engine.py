@@ -0,0 +1,136 @@
+import os
+import time
+
+import numpy as np
+from rtree import index
+
+from grid_file import grid_part_files, load_grid_parts
+from Task2 import combine_counts, exact_counts_batch, load_query_boxes, write_results_to_file
+
+# R-tree engine: every pickup point (lon, lat, time) of grid.bin and its appended deltas in a 3D
+# rtree.index.Index, bulk loaded from a stream (sort-tile-recursive packing in libspatialindex) and kept
+# on disk next to the grid (rtree.idx / rtree.dat). The id of a point is its position in the records of
+# the grid parts, so records are read back from the grid columns and nothing is stored twice.
+# Boxes are closed like in Task2, lon <= up_x etc.
+
+grid_path = '../Datasets/grid.bin'
+index_path = '../Datasets/rtree'
+query_file = '../Datasets/queries.txt'
+report_file = '../Datasets/rtree_benchmark.txt'
+
+
+def rtree_properties():
+    properties = index.Property()
+    properties.dimension = 3
+    properties.leaf_capacity = 100
+    properties.fill_factor = 0.9
+    return properties
+
+
+def point_stream(grid_parts, chunk_size=1_000_000):
+    # (id, (lon, lat, time, lon, lat, time), None) for every record, read from the columns chunk by chunk
+    start = 0
+    for grid in grid_parts:
+        num_records = len(grid['lon'])
+        for begin in range(0, num_records, chunk_size):
+            end = min(begin + chunk_size, num_records)
+            lon = np.asarray(grid['lon'][begin:end], dtype=np.float64).tolist()
+            lat = np.asarray(grid['lat'][begin:end], dtype=np.float64).tolist()
+            timestamp = np.asarray(grid['time'][begin:end], dtype=np.float64).tolist()
+            for i, point in enumerate(zip(lon, lat, timestamp, lon, lat, timestamp)):
+                yield start + begin + i, point, None
+        start += num_records
+
+
+def build_rtree(grid_path, index_path):
+    # writes index_path.idx / index_path.dat, an older index is replaced
+    for name in (index_path + '.idx', index_path + '.dat'):
+        if os.path.exists(name):
+            os.remove(name)
+    grid_parts = load_grid_parts(grid_path)
+    rtree = index.Index(index_path, point_stream(grid_parts), properties=rtree_properties())
+    rtree.close()
+    return sum(len(grid['lon']) for grid in grid_parts)
+
+
+def load_rtree(index_path):
+    return index.Index(index_path, properties=rtree_properties())
+
+
+def exact_counts_rtree(rtree, boxes):
+    # one count per (low_x, up_x, low_y, up_y, low_time, up_time) box
+    return [rtree.count((low_x, low_y, low_time, up_x, up_y, up_time))
+            for low_x, up_x, low_y, up_y, low_time, up_time in np.asarray(boxes, dtype=np.float64).tolist()]
+
+
+def query_records(rtree, grid_parts, box):
+    # (lon, lat, timestamp, amount) of the records in the box, in the order of the grid parts
+    low_x, up_x, low_y, up_y, low_time, up_time = box
+    ids = np.sort(np.fromiter(rtree.intersection((low_x, low_y, low_time, up_x, up_y, up_time)), dtype=np.int64))
+    records = []
+    start = 0
+    for grid in grid_parts:
+        num_records = len(grid['lon'])
+        part = ids[(start <= ids) & (ids < start + num_records)] - start
+        records.extend(zip(grid['lon'][part].tolist(), grid['lat'][part].tolist(),
+                           grid['time'][part].tolist(), grid['amount'][part].tolist()))
+        start += num_records
+    return records
+
+
+def benchmark(grid_path, index_path, query_file):
+    boxes = load_query_boxes(query_file)
+    report = {'queries': len(boxes)}
+
+    start_time = time.time()
+    report['num_records'] = build_rtree(grid_path, index_path)
+    report['rtree_build'] = time.time() - start_time
+    report['rtree_size'] = sum(os.path.getsize(index_path + ext) for ext in ('.idx', '.dat')) / 2 ** 20
+    report['grid_size'] = sum(os.path.getsize(name) for name in grid_part_files(grid_path)) / 2 ** 20
+
+    # same queries on both engines, from loading the files on disk to the counts
+    start_time = time.time()
+    rtree = load_rtree(index_path)
+    rtree_counts = exact_counts_rtree(rtree, boxes)
+    report['rtree_query'] = time.time() - start_time
+
+    start_time = time.time()
+    grid_counts = combine_counts([exact_counts_batch(grid, boxes).tolist() for grid in load_grid_parts(grid_path)])
+    report['grid_query'] = time.time() - start_time
+
+    report['same_counts'] = rtree_counts == grid_counts
+    rtree.close()
+    return report
+
+
+def save_report(report, file_name):
+    with open(file_name, 'w') as file:
+        file.write(f"Records: {report['num_records']}, queries: {report['queries']}\n")
+        file.write(f"R-tree build: {report['rtree_build']:.2f} seconds, {report['rtree_size']:.2f} MB on disk "
+                   f"(grid.bin: {report['grid_size']:.2f} MB)\n")
+        file.write(f"R-tree exact counts: {report['rtree_query']:.4f} seconds\n")
+        file.write(f"Grid exact counts: {report['grid_query']:.4f} seconds\n")
+        file.write(f"Same counts: {report['same_counts']}\n")
+
+
+if __name__ == "__main__":
+    user_input = input("Enter 1 to build the R-tree, 2 for R-tree exact query processing or 0 to benchmark "
+                       "the R-tree against the grid: ")
+
+    if user_input == "1":
+        start_time = time.time()
+        num_records = build_rtree(grid_path, index_path)
+        print(f"Indexed {num_records} records in '{index_path}' in {time.time() - start_time:.2f} seconds")
+    elif user_input == "2":
+        start_time = time.time()
+        results = exact_counts_rtree(load_rtree(index_path), load_query_boxes(query_file))
+        total_runtime = time.time() - start_time
+        output_file = '../Datasets/exact_query_results_rtree.txt'
+        write_results_to_file(results, output_file, total_runtime)
+    elif user_input == "0":
+        report = benchmark(grid_path, index_path, query_file)
+        save_report(report, report_file)
+        print(report)
+        print(f"Benchmark saved to '{report_file}'")
+    else:
+        print("Invalid input. Please enter 0, 1 or 2.")
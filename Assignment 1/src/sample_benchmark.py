@@ -0,0 +1,72 @@
+import os
+import time
+
+import numpy as np
+
+from grid_file import approximate_box_count, assign_cells, build_grid_file, load_grid_file, load_records, sampled_box_count
+from Task2 import exact_counts_batch, load_query_boxes
+
+# Accuracy of the sampled approximate query against the exact counts of queries.txt for several
+# per-cell sample sizes, sample size 0 is the volume fraction estimate (f * count) for comparison.
+
+subset_file = '../Datasets/subset.parquet'
+query_file = '../Datasets/queries.txt'
+report_file = '../Datasets/sample_benchmark.txt'
+
+
+def benchmark(sample_sizes, shape=(100, 100, 100), partitioning='uniform'):
+    lon, lat, timestamps, amount = load_records(subset_file)
+    bounds = (lon.min(), lon.max(), lat.min(), lat.max(), timestamps.min(), timestamps.max())
+    partitions, edges, shape = assign_cells(lon, lat, timestamps, bounds, shape, partitioning)
+    boxes = load_query_boxes(query_file).tolist()
+    exact = None
+    report = []
+
+    for sample_size in sample_sizes:
+        grid_path = f"../Datasets/grid_sample{sample_size}.bin"
+        build_grid_file(grid_path, lon, lat, timestamps, amount, bounds, partitions, shape, edges,
+                        sample_size=sample_size)
+        grid = load_grid_file(grid_path)
+        if exact is None:
+            exact = exact_counts_batch(grid, np.array(boxes).reshape(-1, 6))
+
+        estimate = sampled_box_count if sample_size > 0 else approximate_box_count
+        start_time = time.time()
+        approximate = np.array([estimate(grid, *box) for box in boxes], dtype=np.float64)
+        approximate_time = time.time() - start_time
+
+        # relative error of the approximate answers, over queries with at least one match
+        nonzero = exact > 0
+        relative_error = np.abs(approximate[nonzero] - exact[nonzero]) / exact[nonzero]
+
+        report.append({
+            'sample_size': sample_size,
+            'file_size': os.path.getsize(grid_path) / 2 ** 20,
+            'approximate_ms': 1000 * approximate_time / max(len(boxes), 1),
+            'mean_error': float(relative_error.mean()) if nonzero.any() else 0.0,
+            'max_error': float(relative_error.max()) if nonzero.any() else 0.0,
+        })
+        print(report[-1])
+        os.remove(grid_path)
+
+    return report
+
+
+def save_report(report, file_name):
+    with open(file_name, 'w') as file:
+        file.write("sample_size,file_size_mb,approximate_ms_per_query,approximate_mean_rel_error,"
+                   "approximate_max_rel_error\n")
+        for entry in report:
+            file.write(f"{entry['sample_size']},{entry['file_size']:.2f},{entry['approximate_ms']:.4f},"
+                       f"{entry['mean_error']:.6f},{entry['max_error']:.6f}\n")
+
+
+if __name__ == "__main__":
+    user_input = input("Enter the sample sizes to try (blank for 0 4 8 16 32 64): ").split()
+    sample_sizes = [int(n) for n in user_input or ['0', '4', '8', '16', '32', '64']]
+    # e.g. "50" for a cubic grid, or "200x200x50"
+    shape = tuple(int(n) for n in (input("Enter the grid resolution (blank for 100): ").strip() or '100').split('x'))
+
+    report = benchmark(sample_sizes, shape * 3 if len(shape) == 1 else shape)
+    save_report(report, report_file)
+    print(f"Sample benchmark saved to '{report_file}'")
@@ -1,61 +1,81 @@
+import os
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # reset the Pandas
 pd.set_option('display.max_columns', None)  # All lines
 pd.set_option('display.expand_frame_repr', False)  # not \n
 pd.set_option('display.max_rows', 50)  # rows number (able to modify)
 
-# 13300000 lines
-df = pd.read_parquet('../Datasets/yellow_tripdata_2009-02.parquet')
+# 13300000 lines, read as a stream of batches so memory stays bounded by the batch size
+parquet_file = pq.ParquetFile('../Datasets/yellow_tripdata_2009-02.parquet')
+batch_size = 1_000_000
 
 # print some lines
-Rows, Columns = df.shape
-print(f"行数: {Rows}")
-print(f"列数: {Columns}")
-print(df.head(30), "\n\n\n")
-
-# select interest
-df_interest = df[['Trip_Pickup_DateTime', 'Start_Lon', 'Start_Lat', 'Total_Amt']]
+print(f"行数: {parquet_file.metadata.num_rows}")
+print(f"列数: {parquet_file.metadata.num_columns}")
+print(f"row groups: {parquet_file.metadata.num_row_groups}")
 
-# detect time error
-df_interest['Trip_Pickup_DateTime'] = pd.to_datetime(df_interest['Trip_Pickup_DateTime'], errors='coerce')
+# select interest, only these columns are read
+columns = ['Trip_Pickup_DateTime', 'Start_Lon', 'Start_Lat', 'Total_Amt']
 
 start_date = '2009-02-01'
 end_date = '2009-03-01'
-df_out_of_range = df_interest[
-    (df_interest['Trip_Pickup_DateTime'] < start_date) |
-    (df_interest['Trip_Pickup_DateTime'] > end_date)
-]
-print(f"out of range: {df_out_of_range.shape[0]}")
-print(df_out_of_range)
-
-
-
-# find outliers
-df_lon_outliers = df_interest[~df_interest['Start_Lon'].between(-180, 180)]
-df_lat_outliers = df_interest[~df_interest['Start_Lat'].between(-90, 90)]
 
-# merge
-df_outliers = pd.concat([df_lon_outliers, df_lat_outliers]).drop_duplicates()
+subset_path = '../Datasets/subset.parquet'
+outliers_path = '../Datasets/outliers.csv'
+
+subset_writer = None
+outliers_header = True
+seen_outliers = set()  # row hashes, outliers are written once like drop_duplicates
+out_of_range_rows = 0
+outlier_rows = 0
+rows = 0
+
+if os.path.exists(outliers_path):
+    os.remove(outliers_path)
+
+for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+    df_interest = batch.to_pandas()
+
+    # detect time error
+    df_interest['Trip_Pickup_DateTime'] = pd.to_datetime(df_interest['Trip_Pickup_DateTime'], errors='coerce')
+    out_of_range = ((df_interest['Trip_Pickup_DateTime'] < start_date) |
+                    (df_interest['Trip_Pickup_DateTime'] > end_date))
+    out_of_range_rows += int(out_of_range.sum())
+
+    # find outliers, rows with lon or lat out of range
+    valid = df_interest['Start_Lon'].between(-180, 180) & df_interest['Start_Lat'].between(-90, 90)
+    df_outliers = df_interest[~valid]
+    if len(df_outliers):
+        hashes = pd.util.hash_pandas_object(df_outliers, index=False)
+        first_seen = ~hashes.duplicated().to_numpy() & ~hashes.isin(seen_outliers).to_numpy()
+        seen_outliers.update(hashes[first_seen])
+        df_outliers = df_outliers[first_seen]
+
+        # save to file, appended batch by batch
+        df_outliers.to_csv(outliers_path, mode='a', header=outliers_header, index=False)
+        outliers_header = False
+        outlier_rows += len(df_outliers)
+
+    # cleaned rows of this batch go straight to the subset file: lon / lat in range, pickup time
+    # parsed and inside [start_date, end_date]
+    keep = valid & df_interest['Trip_Pickup_DateTime'].notna() & ~out_of_range
+    table = pa.Table.from_pandas(df_interest[keep], preserve_index=False)
+    if subset_writer is None:
+        subset_writer = pq.ParquetWriter(subset_path, table.schema)
+    subset_writer.write_table(table.cast(subset_writer.schema))
+    rows += table.num_rows
+
+if subset_writer is not None:
+    subset_writer.close()
+
+print(f"out of range: {out_of_range_rows}")
+print(f"Lon and Lat outliers rows: {outlier_rows}")
 
-# print the outliers
-print(f"Lon and Lat outliers rows: {df_outliers.shape[0]}")
-print(df_outliers)
-
-# save to file
-df_outliers.to_csv('../Datasets/outliers.csv', index=False)
-
-df_interest = df_interest[(df_interest['Start_Lon'].between(-180, 180)) &
-                          (df_interest['Start_Lat'].between(-90, 90))]
-
-# 10%
-# df_select = df_interest.head(1330000)
-
-df_interest.info()
-rows, columns = df_interest.shape
 print(f"rows: {rows}\n")
-print(f"columns: {columns}\n")
-print(df_interest.head(50), "\n\n\n")
-
-# df_interest.to_parquet('../Datasets/subset.parquet', index=False)
-# df_interest.to_csv('../Datasets/subset.csv', index=False)
+print(f"columns: {len(columns)}\n")
+if rows:
+    print(pq.ParquetFile(subset_path).read_row_group(0).slice(0, 50).to_pandas(), "\n\n\n")
@@ -0,0 +1,80 @@
+import os
+import time
+
+import numpy as np
+
+from grid_file import assign_cells, build_grid_file, load_grid_file, load_records
+from Task2 import approximate_query_processing, exact_counts_batch, load_query_boxes
+
+# Build the grid at several resolutions, replay queries.txt on each one and report
+# build time, file size, exact / approximate latency and approximate error.
+
+subset_file = '../Datasets/subset.parquet'
+query_file = '../Datasets/queries.txt'
+report_file = '../Datasets/resolution_tuning.txt'
+
+
+def tune(resolutions, partitioning='uniform'):
+    lon, lat, timestamps, amount = load_records(subset_file)
+    bounds = (lon.min(), lon.max(), lat.min(), lat.max(), timestamps.min(), timestamps.max())
+    boxes = load_query_boxes(query_file)
+    report = []
+
+    for resolution in resolutions:
+        grid_path = f"../Datasets/grid_{'x'.join(map(str, resolution))}.bin"
+
+        # build
+        start_time = time.time()
+        partitions, edges, shape = assign_cells(lon, lat, timestamps, bounds, resolution, partitioning)
+        build_grid_file(grid_path, lon, lat, timestamps, amount, bounds, partitions, shape, edges)
+        build_time = time.time() - start_time
+
+        # replay the workload
+        grid = load_grid_file(grid_path)
+        start_time = time.time()
+        exact = exact_counts_batch(grid, boxes)
+        exact_time = time.time() - start_time
+
+        start_time = time.time()
+        approximate = np.array(approximate_query_processing(grid, query_file, *bounds), dtype=np.float64)
+        approximate_time = time.time() - start_time
+
+        # relative error of the approximate answers, over queries with at least one match
+        nonzero = exact > 0
+        relative_error = np.abs(approximate[nonzero] - exact[nonzero]) / exact[nonzero]
+
+        report.append({
+            'resolution': 'x'.join(map(str, shape)),
+            'build_time': build_time,
+            'file_size': os.path.getsize(grid_path) / 2 ** 20,
+            'exact_ms': 1000 * exact_time / max(len(boxes), 1),
+            'approximate_ms': 1000 * approximate_time / max(len(boxes), 1),
+            'mean_error': float(relative_error.mean()) if nonzero.any() else 0.0,
+            'max_error': float(relative_error.max()) if nonzero.any() else 0.0,
+        })
+        print(report[-1])
+
+    return report
+
+
+def save_report(report, file_name):
+    with open(file_name, 'w') as file:
+        file.write("resolution,build_time_s,file_size_mb,exact_ms_per_query,approximate_ms_per_query,"
+                   "approximate_mean_rel_error,approximate_max_rel_error\n")
+        for entry in report:
+            file.write(f"{entry['resolution']},{entry['build_time']:.3f},{entry['file_size']:.2f},"
+                       f"{entry['exact_ms']:.4f},{entry['approximate_ms']:.4f},"
+                       f"{entry['mean_error']:.6f},{entry['max_error']:.6f}\n")
+
+
+if __name__ == "__main__":
+    # e.g. "25 50 100 200" for cubic grids, or "200x200x50" for one shape
+    user_input = input("Enter the grid resolutions to try (blank for 25 50 100 150 200): ").split()
+    resolutions = []
+    for value in user_input or ['25', '50', '100', '150', '200']:
+        sizes = tuple(int(n) for n in value.split('x'))
+        resolutions.append(sizes * 3 if len(sizes) == 1 else sizes)
+
+    report = tune(resolutions)
+    save_report(report, report_file)
+    print(f"Tuning report saved to '{report_file}'")
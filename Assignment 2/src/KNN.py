@@ -1,22 +1,17 @@
 import numpy as np
 import time
-import pickle
 import heapq
-import bisect
 
-def load_iDistance_info(file_path):
+from index_store import distance_rows, load_index
+from iDistance import iDistanceIndex, load_queries
 
-    with open(file_path, "rb") as file:
-        details = pickle.load(file)
-
-    pivots = details["pivots"]
-    distances = details["distance"]
-    data = details["data"]
-    global_maxd = details["global_maxd"]
-    maxd_per_pivot = details["maxd_per_pivot"]
-    iDistance_array = details["iDistance"]
-    queries = details["queries"]
-    return pivots, distances, data, global_maxd, maxd_per_pivot, iDistance_array, queries
+def load_iDistance_info(index_dir, query_file_path):
+    # everything but the queries is memory mapped from the index directory, slack is the max error
+    # of a stored distance (0 for float64)
+    pivots, distances, data, slack = load_index(index_dir)
+    index = iDistanceIndex.load(index_dir)
+    queries = load_queries(query_file_path)
+    return pivots, distances, data, index, queries, slack
 
 def savetxt(method, results, time, avg_count, param_name=None, param_value=None):
 
@@ -94,7 +89,7 @@ def naive_kNN(data, queries, k):
     avg_count = totalcount / len(queries)
     return results, avg_count
 
-def pivot_kNN(data, queries, pivots, distances, k):
+def pivot_kNN(data, queries, pivots, distances, k, slack=0.0):
     totalcount = 0
     results = []
     # traverse query
@@ -105,14 +100,14 @@ def pivot_kNN(data, queries, pivots, distances, k):
         query_to_pivot_distances = [euclidean_distance(query, data[p]) for p in pivots]
         totalcount += len(pivots)
 
-        for oid, obj in enumerate(data):
+        for (oid, obj), row in zip(enumerate(data), distance_rows(distances)):
             # prune
             skip = False
             for pivot_idx, pivot_dist in enumerate(query_to_pivot_distances):
-                # dynamic epsilon
+                # dynamic epsilon, the stored distances are off by at most slack
                 if len(max_heap) == k:
                     epsilon = -max_heap[0][0]  # search epsilon
-                    if abs(distances[oid][pivot_idx] - pivot_dist) > epsilon:
+                    if abs(row[pivot_idx] - pivot_dist) > epsilon + slack:
                         skip = True
                         break
 
@@ -133,7 +128,7 @@ def pivot_kNN(data, queries, pivots, distances, k):
     avg_count = totalcount / len(queries)
     return results, avg_count
 
-def iDistance_kNN(data, queries, pivots, iDistance_array, k, global_maxd, maxd_per_pivot, distances):
+def iDistance_kNN(data, queries, pivots, index, k, distances, slack=0.0):
     totalcount = 0
     results = []
 
@@ -149,37 +144,31 @@ def iDistance_kNN(data, queries, pivots, iDistance_array, k, global_maxd, maxd_p
         nearest_pivot_idx = np.argmin(query_to_pivot_distances)
         nearest_pivot_dist = query_to_pivot_distances[nearest_pivot_idx]
 
-        # dynamic scan for the nearest pivot
-        lower_bound = nearest_pivot_idx * global_maxd
-        upper_bound = nearest_pivot_idx * global_maxd + maxd_per_pivot[nearest_pivot_idx]
-
-        # binary search
-        iDist_values = [item[0] for item in iDistance_array]
-        start_idx = bisect.bisect_left(iDist_values, lower_bound)
-        end_idx = bisect.bisect_right(iDist_values, upper_bound)
+        # dynamic scan for the nearest pivot, its whole partition
+        lower_bound = 0
+        upper_bound = index.maxd_per_pivot[nearest_pivot_idx]
 
         # initial epsilon and dynamic update
         epsilon = float('inf')
 
-        # scan from lower to upper
-        for i in range(start_idx, end_idx):
-            iDist, oid, pivot_idx_in_array, pivot_id = iDistance_array[i]
+        # scan from lower to upper, the distances of the partition to its pivot read in one go
+        oids = index.search(nearest_pivot_idx, lower_bound, upper_bound)
+        oid_dists = np.asarray(distances[oids, nearest_pivot_idx], dtype=np.float64).tolist()
+        for oid, oid_dist in zip(oids, oid_dists):
 
-            # prune obj
-            if abs(distances[oid][nearest_pivot_idx] - nearest_pivot_dist) > epsilon:
+            # prune obj, widened by the error of the stored distances
+            if abs(oid_dist - nearest_pivot_dist) > epsilon + slack:
                 continue
 
-            # secondary validate
-            if pivot_idx_in_array == nearest_pivot_idx:
-                dist = euclidean_distance(query, data[oid])
-                totalcount += 1
+            dist = euclidean_distance(query, data[oid])
+            totalcount += 1
 
-                if len(max_heap) < k:
-                    heapq.heappush(max_heap, (-dist, oid))
-                    epsilon = -max_heap[0][0] if len(max_heap) == k else float('inf')
-                elif dist < -max_heap[0][0]:
-                    heapq.heapreplace(max_heap, (-dist, oid))
-                    epsilon = -max_heap[0][0]
+            if len(max_heap) < k:
+                heapq.heappush(max_heap, (-dist, oid))
+                epsilon = -max_heap[0][0] if len(max_heap) == k else float('inf')
+            elif dist < -max_heap[0][0]:
+                heapq.heapreplace(max_heap, (-dist, oid))
+                epsilon = -max_heap[0][0]
 
         # update epsilon
         epsilon = -max_heap[0][0] if len(max_heap) == k else float('inf')
@@ -191,31 +180,27 @@ def iDistance_kNN(data, queries, pivots, iDistance_array, k, global_maxd, maxd_p
                 continue  # already scaned the nearest
 
             # prune pivots
-            if pivot_dist - maxd_per_pivot[pivot_idx] <= epsilon:
+            if pivot_dist - index.maxd_per_pivot[pivot_idx] <= epsilon + slack:
                 # not pruned
-                lower_bound = pivot_idx * global_maxd + max(0, pivot_dist - epsilon)
-                upper_bound = pivot_idx * global_maxd + min(maxd_per_pivot[pivot_idx], pivot_dist + epsilon)
-
-                start_idx = bisect.bisect_left(iDist_values, lower_bound)
-                end_idx = bisect.bisect_right(iDist_values, upper_bound)
+                lower_bound = max(0, pivot_dist - epsilon - slack)
+                upper_bound = min(index.maxd_per_pivot[pivot_idx], pivot_dist + epsilon + slack)
 
-                for i in range(start_idx, end_idx):
-                    iDist, oid, pivot_idx_in_array, pivot_id = iDistance_array[i]
+                oids = index.search(pivot_idx, lower_bound, upper_bound)
+                oid_dists = np.asarray(distances[oids, pivot_idx], dtype=np.float64).tolist()
+                for oid, oid_dist in zip(oids, oid_dists):
                     # prune obj
-                    if abs(distances[oid][pivot_idx] - pivot_dist) > epsilon:
+                    if abs(oid_dist - pivot_dist) > epsilon + slack:
                         continue
 
-                    if pivot_idx_in_array == pivot_idx:
-
-                        dist = euclidean_distance(query, data[oid])
-                        totalcount += 1
+                    dist = euclidean_distance(query, data[oid])
+                    totalcount += 1
 
-                        if len(max_heap) < k:
-                            heapq.heappush(max_heap, (-dist, oid))
-                            epsilon = -max_heap[0][0] if len(max_heap) == k else float('inf')
-                        elif dist < -max_heap[0][0]:
-                            heapq.heapreplace(max_heap, (-dist, oid))
-                            epsilon = -max_heap[0][0]
+                    if len(max_heap) < k:
+                        heapq.heappush(max_heap, (-dist, oid))
+                        epsilon = -max_heap[0][0] if len(max_heap) == k else float('inf')
+                    elif dist < -max_heap[0][0]:
+                        heapq.heapreplace(max_heap, (-dist, oid))
+                        epsilon = -max_heap[0][0]
 
 
         # sort to KNN
@@ -239,7 +224,7 @@ def save_time(timing_data, file_name=None):
         print(f"Error saving timing info: {e}")
 
 
-def run_KNN(method, data, queries, pivots, distances, iDistance_array, global_maxd, maxd_per_pivot, k, time_info):
+def run_KNN(method, data, queries, pivots, distances, index, k, time_info, slack=0.0):
     if method == 1:
         start_time = time.time()
         results, avg_counts = naive_kNN(data, queries, k)
@@ -248,13 +233,13 @@ def run_KNN(method, data, queries, pivots, distances, iDistance_array, global_ma
 
     elif method == 2:
         start_time = time.time()
-        results, avg_counts = pivot_kNN(data, queries, pivots, distances, k)
+        results, avg_counts = pivot_kNN(data, queries, pivots, distances, k, slack)
         total_time = time.time() - start_time
         method_name = "Pivots"
 
     elif method == 3:
         start_time = time.time()
-        results, avg_counts = iDistance_kNN(data, queries, pivots, iDistance_array, k, global_maxd, maxd_per_pivot, distances)
+        results, avg_counts = iDistance_kNN(data, queries, pivots, index, k, distances, slack)
         total_time = time.time() - start_time
         method_name = "iDistance"
 
@@ -282,10 +267,11 @@ def run_KNN(method, data, queries, pivots, distances, iDistance_array, global_ma
 
 if __name__ == "__main__":
 
-    data_file_path = '../data/iDistance.pkl'
+    index_dir = '../data/index'
+    query_file_path = '../data/queries10.txt'
 
     # 加载数据
-    pivots, distances, data, global_maxd, maxd_per_pivot, iDistance_array, queries = load_iDistance_info(data_file_path)
+    pivots, distances, data, index, queries, slack = load_iDistance_info(index_dir, query_file_path)
 
     method = int(input("enter method (0 for all methods): "))
 
@@ -297,7 +283,7 @@ if __name__ == "__main__":
 
         for k in [1, 5, 10, 50, 100]:
             for m in range(1, 4):
-                run_KNN(m, data, queries, pivots, distances, iDistance_array, global_maxd, maxd_per_pivot, k, time_info)
+                run_KNN(m, data, queries, pivots, distances, index, k, time_info, slack)
 
         save_time(time_info, file_name='../data/KNN_Timeinfo.txt')
 
@@ -305,7 +291,7 @@ if __name__ == "__main__":
 
         k = int(input("Enter number of nearest neighbors (k): "))
 
-        run_KNN(method, data, queries, pivots, distances, iDistance_array, global_maxd, maxd_per_pivot, k, time_info)
+        run_KNN(method, data, queries, pivots, distances, index, k, time_info, slack)
 
     else:
         print("Invalid method")
@@ -2,7 +2,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
-import pickle
+
+from index_store import save_index
 
 
 class PivotSelector:
@@ -22,50 +23,111 @@ class PivotSelector:
     def euclidean_distance(self, a, b):
         return np.sqrt(np.sum((a - b) ** 2))
 
-    def compute_pivots(self, numpivots):
+    def distances_to(self, point):
+        # distance from every object to one point, one (n,) computation instead of n euclidean_distance calls
+        return np.sqrt(np.sum((self.data - point) ** 2, axis=1))
+
+    def compute_pivots(self, numpivots, strategy='max_sum', save=True):
+        selectors = {
+            'max_sum': self.max_sum_pivots,
+            'max_min': self.max_min_pivots,
+            'kmeans++': self.kmeans_pp_pivots,
+            'incremental': self.incremental_pivots,
+            'pca': self.pca_pivots,
+        }
+        if strategy not in selectors:
+            raise ValueError(f"Unsupported strategy. Choose one of {', '.join(selectors)}.")
+
         n = len(self.data)
         self.pivots = []
         self.distances = np.zeros((n, numpivots))
+        selectors[strategy](numpivots)
+
+        if save:
+            self.save_pivot_info()
+
+        return self.pivots, self.distances
+
+    def add_pivot(self, oid):
+        # new pivot, its distance column is computed once and stored in the distances array
+        k = len(self.pivots)
+        self.pivots.append(int(oid))
+        self.distances[:, k] = self.distances_to(self.data[oid])
+        return self.distances[:, k]
+
+    def max_sum_pivots(self, numpivots):
+        # seed as data[0], first pivot is the farthest object (first one on ties)
+        seed = self.data[0]
+        column = self.add_pivot(np.argmax(self.distances_to(seed)))
+
+        # next pivots: max sum of distances to the chosen pivots. sum_dist is kept up to date with the
+        # distance column of every new pivot
+        sum_dist = np.zeros(len(self.data))
+        for k in range(1, numpivots):
+            sum_dist += column
+            column = self.add_pivot(np.argmax(sum_dist))
 
-        # seed as data[0]
+    def max_min_pivots(self, numpivots):
+        # farthest-first: same first pivot, then the object farthest from its nearest pivot
         seed = self.data[0]
-        max_dist = -1
-        first_pivot = 0
-        for i in range(n):
-            dist = self.euclidean_distance(seed, self.data[i])
-            if dist > max_dist:
-                max_dist = dist
-                first_pivot = i
-        self.pivots.append(first_pivot)
-
-        # next pivots
+        column = self.add_pivot(np.argmax(self.distances_to(seed)))
+
+        min_dist = column.copy()
         for k in range(1, numpivots):
-            max_sum_dist = -1
-            next_pivot = 0
-            for i in range(n):
-                sum_dist = sum(self.euclidean_distance(self.data[i], self.data[p]) for p in self.pivots)
-                if sum_dist > max_sum_dist:
-                    max_sum_dist = sum_dist
-                    next_pivot = i
-            self.pivots.append(next_pivot)
-
-        # filling distances list
-        for i in range(n):
-            for j, pivot in enumerate(self.pivots):
-                self.distances[i][j] = self.euclidean_distance(self.data[i], self.data[pivot])
-
-        self.save_pivot_info()
+            column = self.add_pivot(np.argmax(min_dist))
+            min_dist = np.minimum(min_dist, column)
 
-        return self.pivots, self.distances
+    def kmeans_pp_pivots(self, numpivots, seed=0):
+        # k-means++ seeding: random first pivot, then objects drawn with probability ~ squared
+        # distance to the nearest pivot, spread out but rarely a lone outlier
+        rng = np.random.default_rng(seed)
+        column = self.add_pivot(rng.integers(len(self.data)))
 
-    def save_pivot_info(self):
-        with open("../data/pivots_info.pkl", "wb") as file:
-            pickle.dump({
-                "pivots": self.pivots,
-                "distances": self.distances,
-                "data": self.data
-            }, file)
-        print("Pivot information saved to 'pivots_info.pkl'")
+        min_dist = column.copy()
+        for k in range(1, numpivots):
+            weight = min_dist ** 2
+            if weight.sum() > 0:
+                column = self.add_pivot(rng.choice(len(self.data), p=weight / weight.sum()))
+            else:
+                column = self.add_pivot(rng.integers(len(self.data)))
+            min_dist = np.minimum(min_dist, column)
+
+    def incremental_pivots(self, numpivots, candidates=40, pairs=1000, seed=0):
+        # incremental selection (Bustos et al.): for every new pivot, try a random sample of candidates and keep
+        # the one that maximizes the mean lower bound max_p |d(a, p) - d(b, p)| over a random sample of object pairs
+        rng = np.random.default_rng(seed)
+        n = len(self.data)
+        pair_a, pair_b = rng.integers(n, size=(2, pairs))
+        lower = np.zeros(pairs)
+
+        for k in range(numpivots):
+            sample = rng.choice(n, size=min(candidates, n), replace=False)
+            to_a = np.sqrt(np.sum((self.data[sample][:, None, :] - self.data[pair_a][None, :, :]) ** 2, axis=2))
+            to_b = np.sqrt(np.sum((self.data[sample][:, None, :] - self.data[pair_b][None, :, :]) ** 2, axis=2))
+            gain = np.maximum(lower, np.abs(to_a - to_b)).mean(axis=1)
+
+            column = self.add_pivot(sample[np.argmax(gain)])
+            lower = np.maximum(lower, np.abs(column[pair_a] - column[pair_b]))
+
+    def pca_pivots(self, numpivots):
+        # the two extreme objects along each principal axis, most spread axis first,
+        # farthest-first for the rest when there are more pivots than 2 x dimensions
+        num_axes = min((numpivots + 1) // 2, self.data.shape[1])
+        projection = PCA(n_components=num_axes).fit_transform(self.data) if num_axes > 0 else np.empty((0, 0))
+
+        min_dist = np.full(len(self.data), np.inf)
+        for axis in range(num_axes):
+            for oid in (np.argmax(projection[:, axis]), np.argmin(projection[:, axis])):
+                if len(self.pivots) < numpivots and int(oid) not in self.pivots:
+                    min_dist = np.minimum(min_dist, self.add_pivot(oid))
+
+        while len(self.pivots) < numpivots:
+            min_dist = np.minimum(min_dist, self.add_pivot(np.argmax(min_dist)))
+
+    def save_pivot_info(self, index_dir='../data/index', distance_dtype='float32'):
+        # .npy files instead of one pickle, the distance table as float32 (or uint16)
+        save_index(index_dir, self.data, self.pivots, self.distances, distance_dtype)
+        print(f"Pivot information saved to '{index_dir}' ({distance_dtype} distances)")
 
 '''
     def visualize_pivots(self, method='pca'):
@@ -93,9 +155,14 @@ class PivotSelector:
 if __name__ == "__main__":
     file_path = '../data/data10K10.txt'
     numpivots = int(input())
+    # max_sum (default), max_min, kmeans++, incremental or pca
+    strategy = input("enter pivot selection strategy (blank for max_sum): ").strip() or 'max_sum'
+    # float32 (default), uint16 for the smallest table, float64 for the exact one
+    distance_dtype = input("enter distance table dtype (blank for float32): ").strip() or 'float32'
 
     selector = PivotSelector(file_path)
-    pivots, distances = selector.compute_pivots(numpivots)
+    pivots, distances = selector.compute_pivots(numpivots, strategy, save=False)
+    selector.save_pivot_info(distance_dtype=distance_dtype)
     print("Pivots:", pivots)
     print("Distances array:\n", distances)
 
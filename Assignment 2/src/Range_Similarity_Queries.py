@@ -1,21 +1,16 @@
 import numpy as np
 import time
-import pickle
-import bisect
 
-def load_iDistance_info(file_path):
+from index_store import distance_rows, load_index
+from iDistance import iDistanceIndex, load_queries
 
-    with open(file_path, "rb") as file:
-        details = pickle.load(file)
-
-    pivots = details["pivots"]
-    distances = details["distance"]
-    data = details["data"]
-    global_maxd = details["global_maxd"]
-    maxd_per_pivot = details["maxd_per_pivot"]
-    iDistance_array = details["iDistance"]
-    queries = details["queries"]
-    return pivots, distances, data, global_maxd, maxd_per_pivot, iDistance_array, queries
+def load_iDistance_info(index_dir, query_file_path):
+    # everything but the queries is memory mapped from the index directory, slack is the max error
+    # of a stored distance (0 for float64)
+    pivots, distances, data, slack = load_index(index_dir)
+    index = iDistanceIndex.load(index_dir)
+    queries = load_queries(query_file_path)
+    return pivots, distances, data, index, queries, slack
 
 def euclidean_distance(a, b):
 
@@ -40,7 +35,7 @@ def naive_range_query(data, queries, epsilon):
     return results, avg_count
 
 
-def pivot_range_query(data, queries, pivots, distances, epsilon):
+def pivot_range_query(data, queries, pivots, distances, epsilon, slack=0.0):
     totalcount = 0
     results = []
 
@@ -51,11 +46,11 @@ def pivot_range_query(data, queries, pivots, distances, epsilon):
         query_to_pivot_distances = [euclidean_distance(query, data[p]) for p in pivots]
         totalcount += len(pivots)
 
-        for oid, obj in enumerate(data):
-            # prune criteria
+        for (oid, obj), row in zip(enumerate(data), distance_rows(distances)):
+            # prune criteria, the stored distances are off by at most slack
             skip = False
             for p_idx, pivot_dist in enumerate(query_to_pivot_distances):
-                if abs(distances[oid][p_idx] - pivot_dist) > epsilon:
+                if abs(row[p_idx] - pivot_dist) > epsilon + slack:
                     skip = True
                     break
 
@@ -72,7 +67,7 @@ def pivot_range_query(data, queries, pivots, distances, epsilon):
     return results, avg_count
 
 
-def iDistance_range_query(data, queries, pivots, iDistance_array, epsilon, global_maxd, maxd_per_pivot):
+def iDistance_range_query(data, queries, pivots, index, epsilon, slack=0.0):
     results = []
     totalcount = 0
 
@@ -84,29 +79,20 @@ def iDistance_range_query(data, queries, pivots, iDistance_array, epsilon, globa
             dist_to_pivot = euclidean_distance(query, data[pivot])
             totalcount += 1
 
-            # prune
-            if dist_to_pivot - maxd_per_pivot[pivot_idx] > epsilon:
+            # prune, keys and maxd come from the stored distances, widened by slack
+            if dist_to_pivot - index.maxd_per_pivot[pivot_idx] > epsilon + slack:
                 continue
 
             # not pruned
-            lower_bound = pivot_idx * global_maxd + max(0, dist_to_pivot - epsilon)
-            upper_bound = pivot_idx * global_maxd + min(maxd_per_pivot[pivot_idx], dist_to_pivot + epsilon)
-
-            # binary search
-            iDist_values = [item[0] for item in iDistance_array]
-            start_idx = bisect.bisect_left(iDist_values, lower_bound)
-            end_idx = bisect.bisect_right(iDist_values, upper_bound)
-
-            # scan from lower to upper
-            for i in range(start_idx, end_idx):
-                iDist, oid, pivot_idx_in_array, pivot_id = iDistance_array[i]
-
-                # avoid distances mistakes
-                if pivot_idx_in_array == pivot_idx:
-                    dist = euclidean_distance(query, data[oid])
-                    totalcount += 1
-                    if dist <= epsilon:
-                        result.append(oid)
+            lower_bound = max(0, dist_to_pivot - epsilon - slack)
+            upper_bound = min(index.maxd_per_pivot[pivot_idx], dist_to_pivot + epsilon + slack)
+
+            # binary search inside the pivot's partition, scan from lower to upper
+            for oid in index.search(pivot_idx, lower_bound, upper_bound):
+                dist = euclidean_distance(query, data[oid])
+                totalcount += 1
+                if dist <= epsilon:
+                    result.append(oid)
         result.sort()
         results.append(result)
 
@@ -174,7 +160,7 @@ def save_time(timing_data, file_name='time_info.txt'):
         print(f"Error saving timing info: {e}")
 
 
-def run_query(method, data, queries, pivots, distances, iDistance_array, global_maxd, maxd_per_pivot, epsilon, time_info):
+def run_query(method, data, queries, pivots, distances, index, epsilon, time_info, slack=0.0):
 
     if method == 1:
         start_time = time.time()
@@ -184,13 +170,13 @@ def run_query(method, data, queries, pivots, distances, iDistance_array, global_
 
     elif method == 2:
         start_time = time.time()
-        results, avg_counts = pivot_range_query(data, queries, pivots, distances, epsilon)
+        results, avg_counts = pivot_range_query(data, queries, pivots, distances, epsilon, slack)
         total_time = time.time() - start_time
         method_name = "Pivots"
 
     elif method == 3:
         start_time = time.time()
-        results, avg_counts = iDistance_range_query(data, queries, pivots, iDistance_array, epsilon, global_maxd, maxd_per_pivot)
+        results, avg_counts = iDistance_range_query(data, queries, pivots, index, epsilon, slack)
         total_time = time.time() - start_time
         method_name = "iDistance"
 
@@ -214,11 +200,11 @@ def run_query(method, data, queries, pivots, distances, iDistance_array, global_
 
 if __name__ == "__main__":
 
-    data_file_path = '../data/iDistance.pkl'
+    index_dir = '../data/index'
     query_file_path = '../data/queries10.txt'
 
     # load data
-    pivots, distances, data, global_maxd, maxd_per_pivot, iDistance_array, queries = load_iDistance_info(data_file_path)
+    pivots, distances, data, index, queries, slack = load_iDistance_info(index_dir, query_file_path)
 
     # capture input
     method = int(input("enter method (0 for all methods): "))
@@ -230,7 +216,7 @@ if __name__ == "__main__":
         # do all
         for epsilon in [0.1, 0.2, 0.4, 0.8]:
             for m in range(1, 4):
-                run_query(m, data, queries, pivots, distances, iDistance_array, global_maxd, maxd_per_pivot, epsilon, time_info)
+                run_query(m, data, queries, pivots, distances, index, epsilon, time_info, slack)
 
         save_time(time_info, file_name='../data/Range_Query_Timeinfo.txt')
 
@@ -238,7 +224,7 @@ if __name__ == "__main__":
 
         epsilon = float(input("enter ɛ: "))
         # do certain
-        run_query(method, data, queries, pivots, distances, iDistance_array, global_maxd, maxd_per_pivot, epsilon, time_info)
+        run_query(method, data, queries, pivots, distances, index, epsilon, time_info, slack)
 
     else:
         print("Invalid method")
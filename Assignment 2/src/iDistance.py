@@ -1,17 +1,13 @@
-import pickle
 import numpy as np
 
-# 本来这里还想继续搞得像模像样的像个正经工程一样的，但是奈何文件要求一步一步来的，那还是直接面向过程写吧.....
-
-def load_pivot_info(file_path):
+from index_store import load_iDistance, load_index, save_iDistance
 
-    with open(file_path, "rb") as file:
-        details = pickle.load(file)
+# 本来这里还想继续搞得像模像样的像个正经工程一样的，但是奈何文件要求一步一步来的，那还是直接面向过程写吧.....
 
-    pivots = details["pivots"]
-    distances = details["distances"]
-    data = details["data"]
-    return pivots, distances, data
+def load_pivot_info(index_dir):
+    # pivots, distance table and data of the index directory written by PivotSelector, memory mapped
+    pivots, distances, data, slack = load_index(index_dir)
+    return pivots, distances, data, slack
 
 def load_queries(file_path):
 
@@ -21,71 +17,93 @@ def load_queries(file_path):
             queries.append(list(map(float, line.strip().split())))
     return np.array(queries)
 
-def compute_max_distances(data, pivots, distances):
-    n = len(data)
-    numpivots = len(pivots)
-    maxd = np.zeros(numpivots)  # maxd_per_pivot
-
-    # assign objects, calculate distances, and find global_maxd
-    for oid in range(n):
-        # nearest pivot
-        nearest_pivot_idx = np.argmin(distances[oid])
-        nearest_pivot_dist = distances[oid][nearest_pivot_idx]
-
-        # refresh maxd_per_pivot
-        if nearest_pivot_dist > maxd[nearest_pivot_idx]:
-            maxd[nearest_pivot_idx] = nearest_pivot_dist
+def nearest_pivots(distances, chunk_size=1 << 16):
+    # nearest pivot (first one on ties) and the distance to it for every object, the distance table is
+    # read chunk by chunk so a memory mapped table is never loaded whole
+    n = len(distances)
+    nearest_idx = np.empty(n, dtype=np.int16)
+    nearest_dist = np.empty(n, dtype=np.float64)
+    for begin in range(0, n, chunk_size):
+        block = np.asarray(distances[begin:begin + chunk_size], dtype=np.float64)
+        end = begin + len(block)
+        nearest_idx[begin:end] = np.argmin(block, axis=1)
+        nearest_dist[begin:end] = block[np.arange(len(block)), nearest_idx[begin:end]]
+    return nearest_idx, nearest_dist
+
+def compute_max_distances(data, pivots, distances, nearest=None):
+    nearest_idx, nearest_dist = nearest if nearest is not None else nearest_pivots(distances)
+    maxd = np.zeros(len(pivots))  # maxd_per_pivot
+    np.maximum.at(maxd, nearest_idx, nearest_dist)
 
     # max(maxd) -> global_maxd
     return max(maxd), maxd
 
-# 示例调用
 def compute_iDistance(data, pivots, distances):
-    n = len(data)
-    iDist_array = []  # save (iDist, oid)
-
-    global_maxd, maxd_per_pivot = compute_max_distances(data, pivots, distances)
-
-    # traverse, calculate iDist and sort
-    for oid in range(n):
-        # nearest pivot
-        nearest_pivot_idx = np.argmin(distances[oid])
-        nearest_pivot_dist = distances[oid][nearest_pivot_idx]
-
-        iDist = nearest_pivot_idx * global_maxd + nearest_pivot_dist
-
-        pivot_id = pivots[nearest_pivot_idx]
-        iDist_array.append((iDist, oid, nearest_pivot_idx, pivot_id))
-        # iDist_array.append((iDist, oid))
-
-    # sort
-    iDist_array.sort()
-
+    # struct of arrays, sorted by (pivot, iDist, oid):
+    #   keys       float64 iDist = pivot_idx * global_maxd + distance to the nearest pivot
+    #   oids       int32
+    #   pivot_idx  int16 nearest pivot of every object
+    #   offsets    partition of pivot p is [offsets[p], offsets[p + 1])
+    nearest_idx, nearest_dist = nearest_pivots(distances)
+    global_maxd, maxd_per_pivot = compute_max_distances(data, pivots, distances, (nearest_idx, nearest_dist))
+
+    keys = nearest_idx * global_maxd + nearest_dist
+    oids = np.arange(len(keys), dtype=np.int32)
+    # pivot first: an object at exactly global_maxd from its pivot has the key of the next pivot itself
+    order = np.lexsort((oids, keys, nearest_idx))
+
+    iDist_array = {
+        'keys': keys[order],
+        'oids': oids[order],
+        'pivot_idx': nearest_idx[order],
+        'offsets': np.searchsorted(nearest_idx[order], np.arange(len(pivots) + 1)).astype(np.int64)
+    }
     return iDist_array, global_maxd, maxd_per_pivot
 
 
-file_path = "../data/pivots_info.pkl"
-query_path = '../data/queries10.txt'
-pivots, distances, data = load_pivot_info(file_path)
-queries = load_queries(query_path)
-
-print("Loaded Pivots:", pivots)
-print("Loaded Distances Array:\n", distances)
-
-iDist_array, global_maxd, maxd_per_pivot = compute_iDistance(data, pivots, distances)
-
-with open("../data/iDistance.pkl", "wb") as file:
-    pickle.dump({
-        "pivots": pivots,
-        "distance": distances,
-        "global_maxd": global_maxd,
-        "maxd_per_pivot": maxd_per_pivot,
-        "iDistance": iDist_array,
-        "data": data,
-        "queries": queries
-    }, file)
-print("Pivot information saved to 'pivots_info.pkl'")
-
-print("iDistance array:", iDist_array)
-print("Global maxd:", global_maxd)
-print("Maxd per pivot:", maxd_per_pivot)
+class iDistanceIndex:
+    # built once (or loaded from the index directory) and kept for every query: the key array and the
+    # partition offsets are never rebuilt, a search is two binary searches inside one pivot's partition
+    def __init__(self, iDist_array, global_maxd, maxd_per_pivot):
+        self.keys = iDist_array['keys']
+        self.oids = iDist_array['oids']
+        self.offsets = np.asarray(iDist_array['offsets']).tolist()
+        self.global_maxd = global_maxd
+        self.maxd_per_pivot = maxd_per_pivot
+
+    @classmethod
+    def build(cls, data, pivots, distances):
+        return cls(*compute_iDistance(data, pivots, distances))
+
+    @classmethod
+    def load(cls, index_dir):
+        return cls(*load_iDistance(index_dir))
+
+    def search(self, pivot_idx, low, high):
+        # oids assigned to the pivot with low <= distance to it <= high, in key order
+        start, end = self.offsets[pivot_idx], self.offsets[pivot_idx + 1]
+        base = pivot_idx * self.global_maxd
+        keys = self.keys[start:end]
+        first = start + np.searchsorted(keys, base + low, side='left')
+        last = start + np.searchsorted(keys, base + high, side='right')
+        return self.oids[first:last].tolist()
+
+
+# the queries and the benchmark import iDistanceIndex, the script part only runs directly
+if __name__ == "__main__":
+    index_dir = "../data/index"
+    pivots, distances, data, slack = load_pivot_info(index_dir)
+
+    print("Loaded Pivots:", pivots)
+    print("Loaded Distances Array:", distances.shape, distances.dtype)
+
+    iDist_array, global_maxd, maxd_per_pivot = compute_iDistance(data, pivots, distances)
+
+    # next to the pivots and the distance table, loaded with np.load(mmap_mode='r')
+    save_iDistance(index_dir, iDist_array, maxd_per_pivot)
+    print(f"iDistance information saved to '{index_dir}'")
+
+    print("iDistance keys:", iDist_array['keys'])
+    print("Objects per pivot:", np.diff(iDist_array['offsets']))
+    print("Global maxd:", global_maxd)
+    print("Maxd per pivot:", maxd_per_pivot)
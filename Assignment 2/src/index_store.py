@@ -0,0 +1,112 @@
+import glob
+import json
+import os
+
+import numpy as np
+
+# Index directory: the data matrix and the pivot distance table as .npy files, opened with
+# np.load(mmap_mode='r') so nothing is read before a query touches it. The maps are handed out as plain
+# ndarrays (np.asarray), indexing a np.memmap builds a memmap object on every access, which costs more
+# than the access itself in the per-object loops of the queries.
+#
+#   data.npy        (n, dim) float64, exact distances to the queries are computed on it
+#   pivots.npy      pivot oids, int64
+#   distances.npy   (n, numpivots) distance of every object to every pivot, float32 or uint16
+#   index.json      dtype, uint16 scale and the slack
+#   idist_*.npy     iDistance arrays (keys, oids, pivot_idx, offsets) and maxd of every pivot, iDistance.py,
+#                   removed by save_index: they belong to the pivots and the distances they were built from
+#
+# The stored distances are off by at most `slack` from the exact ones, so every pivot lower bound
+# |d(o, p) - d(q, p)| > eps is checked as > eps + slack, pruning never drops a real answer.
+
+DISTANCE_DTYPES = ('float64', 'float32', 'uint16')
+
+
+class QuantizedDistances:
+    # uint16 distance table, decoded to float64 on access: distances[oid][p_idx], distances[:, k] ...
+    def __init__(self, codes, scale):
+        self.codes = codes
+        self.scale = scale
+        self.shape = codes.shape
+        self.dtype = codes.dtype
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        return self.codes[key] * self.scale
+
+
+def distance_rows(distances, chunk_size=1 << 12):
+    # the rows of the distance table in oid order as lists of floats, read (and decoded for uint16) a block
+    # of rows at a time instead of one scalar per pivot test
+    for begin in range(0, len(distances), chunk_size):
+        yield from np.asarray(distances[begin:begin + chunk_size], dtype=np.float64).tolist()
+
+
+def mapped(path):
+    return np.asarray(np.load(path, mmap_mode='r'))
+
+
+def encode_distances(distances, dtype='float32'):
+    # stored table, uint16 scale and the max error of a stored distance
+    if dtype not in DISTANCE_DTYPES:
+        raise ValueError(f"Unsupported distance dtype. Choose one of {', '.join(DISTANCE_DTYPES)}.")
+    distances = np.asarray(distances, dtype=np.float64)
+    max_dist = float(distances.max()) if distances.size else 0.0
+
+    if dtype == 'float64':
+        return distances, 1.0, 0.0
+    if dtype == 'float32':
+        # rounding to nearest float32 is off by half an ulp, one ulp at the max distance covers every value
+        return distances.astype(np.float32), 1.0, float(np.spacing(np.float32(max_dist)))
+
+    # uint16: rounded to the nearest step of max_dist / 65535, off by half a step, plus a little for the
+    # float64 rounding of the division
+    scale = max_dist / 65535 if max_dist > 0 else 1.0
+    codes = np.rint(distances / scale).astype(np.uint16)
+    return codes, scale, 0.5 * scale + 4 * float(np.spacing(max_dist))
+
+
+def save_index(index_dir, data, pivots, distances, distance_dtype='float32'):
+    os.makedirs(index_dir, exist_ok=True)
+    codes, scale, slack = encode_distances(distances, distance_dtype)
+
+    # an iDistance index of older pivots (or another dtype, another slack) must not be read with the new ones
+    for name in glob.glob(os.path.join(glob.escape(index_dir), 'idist_*.npy')):
+        os.remove(name)
+    np.save(os.path.join(index_dir, 'data.npy'), np.asarray(data, dtype=np.float64))
+    np.save(os.path.join(index_dir, 'pivots.npy'), np.asarray(pivots, dtype=np.int64))
+    np.save(os.path.join(index_dir, 'distances.npy'), codes)
+    with open(os.path.join(index_dir, 'index.json'), 'w') as file:
+        json.dump({'distance_dtype': distance_dtype, 'scale': scale, 'slack': slack}, file)
+
+
+def load_index(index_dir):
+    # pivots (list), distances (memory mapped, decoded on access for uint16), data (memory mapped), slack
+    with open(os.path.join(index_dir, 'index.json'), 'r') as file:
+        info = json.load(file)
+    data = mapped(os.path.join(index_dir, 'data.npy'))
+    pivots = np.load(os.path.join(index_dir, 'pivots.npy')).tolist()
+    distances = mapped(os.path.join(index_dir, 'distances.npy'))
+    if info['distance_dtype'] == 'uint16':
+        distances = QuantizedDistances(distances, info['scale'])
+    return pivots, distances, data, info['slack']
+
+
+IDISTANCE_ARRAYS = ('keys', 'oids', 'pivot_idx', 'offsets')
+
+
+def save_iDistance(index_dir, iDist_array, maxd_per_pivot):
+    for name in IDISTANCE_ARRAYS:
+        np.save(os.path.join(index_dir, f'idist_{name}.npy'), iDist_array[name])
+    np.save(os.path.join(index_dir, 'idist_maxd.npy'), np.asarray(maxd_per_pivot, dtype=np.float64))
+
+
+def load_iDistance(index_dir):
+    # iDistance arrays (memory mapped), global_maxd and maxd_per_pivot
+    if not os.path.exists(os.path.join(index_dir, 'idist_maxd.npy')):
+        raise FileNotFoundError(f"no iDistance index in '{index_dir}' for its current pivots, run iDistance.py first")
+    iDist_array = {name: mapped(os.path.join(index_dir, f'idist_{name}.npy')) for name in IDISTANCE_ARRAYS}
+    maxd_per_pivot = np.load(os.path.join(index_dir, 'idist_maxd.npy'))
+    return iDist_array, max(maxd_per_pivot), maxd_per_pivot
@@ -0,0 +1,66 @@
+import time
+
+from PivotSelector import PivotSelector
+from iDistance import iDistanceIndex, load_queries
+from Range_Similarity_Queries import pivot_range_query, iDistance_range_query
+from KNN import pivot_kNN, iDistance_kNN
+
+# pruning power of every pivot selection strategy: average distance computations per query (avg_count)
+# of the pivot and iDistance range / KNN queries, lower is better
+
+
+def benchmark(selector, queries, numpivots, strategies, epsilon, k):
+    results = []
+    for strategy in strategies:
+        start_time = time.time()
+        pivots, distances = selector.compute_pivots(numpivots, strategy, save=False)
+        select_time = time.time() - start_time
+
+        index = iDistanceIndex.build(selector.data, pivots, distances)
+
+        _, pivot_range = pivot_range_query(selector.data, queries, pivots, distances, epsilon)
+        _, iDistance_range = iDistance_range_query(selector.data, queries, pivots, index, epsilon)
+        _, pivot_knn = pivot_kNN(selector.data, queries, pivots, distances, k)
+        _, iDistance_knn = iDistance_kNN(selector.data, queries, pivots, index, k, distances)
+
+        results.append({
+            'strategy': strategy,
+            'select_time': select_time,
+            'pivot_range': pivot_range,
+            'iDistance_range': iDistance_range,
+            'pivot_knn': pivot_knn,
+            'iDistance_knn': iDistance_knn
+        })
+        print(results[-1])
+    return results
+
+
+def save_benchmark(results, epsilon, k, file_name):
+    try:
+        with open(file_name, 'w') as file:
+            file.write(f"strategy,select_time,Pivots_query_ɛ_{epsilon},iDistance_query_ɛ_{epsilon},"
+                       f"Pivots_KNN_K_{k},iDistance_KNN_K_{k}\n")
+            for entry in results:
+                file.write(f"{entry['strategy']},{entry['select_time']:.6f},{entry['pivot_range']},"
+                           f"{entry['iDistance_range']},{entry['pivot_knn']},{entry['iDistance_knn']}\n")
+    except Exception as e:
+        print(f"Error saving benchmark: {e}")
+
+
+if __name__ == "__main__":
+    data_file_path = '../data/data10K10.txt'
+    query_file_path = '../data/queries10.txt'
+
+    numpivots = int(input("enter number of pivots: "))
+    epsilon = float(input("enter ɛ: "))
+    k = int(input("Enter number of nearest neighbors (k): "))
+    num_queries = int(input("enter number of queries (0 for all): "))
+
+    selector = PivotSelector(data_file_path)
+    queries = load_queries(query_file_path)
+    if num_queries > 0:
+        queries = queries[:num_queries]
+
+    results = benchmark(selector, queries, numpivots, ['max_sum', 'max_min', 'kmeans++', 'incremental', 'pca'],
+                        epsilon, k)
+    save_benchmark(results, epsilon, k, '../data/Pivot_Benchmark.txt')